@@ -2,6 +2,8 @@
 ASGI config for polls project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Live poll results (``/api/v1/polls/<id>/live/``) are streamed as Server-Sent Events
+next to the regular Django application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +15,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'polls.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from pollsapp.live import live_results_application  # noqa: E402 (needs configured settings)
+
+application = live_results_application(django_application)
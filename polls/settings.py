@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -46,6 +47,20 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware'
 ]
+
+# Per-request query count / timing instrumentation (Server-Timing header, /api/v1/metrics/)
+POLLS_INSTRUMENTATION = os.environ.get('POLLS_INSTRUMENTATION', '') == 'True'
+POLLS_QUERY_BUDGET = int(os.environ.get('POLLS_QUERY_BUDGET', 20))
+
+if POLLS_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'pollsapp.middleware.QueryInstrumentationMiddleware')
+
+# Write-behind buffer of submissions (path of a local SQLite file, empty saves submissions synchronously)
+POLLS_SUBMISSION_BUFFER = os.environ.get('POLLS_SUBMISSION_BUFFER', '')
+POLLS_SUBMISSION_BUFFER_LIMIT = int(os.environ.get('POLLS_SUBMISSION_BUFFER_LIMIT', 10000))
+POLLS_SUBMISSION_FLUSH_BATCH = int(os.environ.get('POLLS_SUBMISSION_FLUSH_BATCH', 500))
+POLLS_SUBMISSION_FLUSH_INTERVAL = float(os.environ.get('POLLS_SUBMISSION_FLUSH_INTERVAL', 1))
+
 INSTALLED_APPS = [
     'pollsapp',
     'django.contrib.admin',
@@ -67,7 +82,7 @@ INSTALLED_APPS = [
 
 # dodano zbog email authentication
 AUTHENTICATION_BACKENDS = (
-   "django.contrib.auth.backends.ModelBackend",
+   "pollsapp.authentication.CachedModelBackend",
    "allauth.account.auth_backends.AuthenticationBackend"
 )
 
@@ -76,8 +91,18 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'pollsapp.authentication.CachedTokenAuthentication',
     ],
+    # orjson/ujson kad su instalirani, MessagePack (Accept: application/msgpack) uz paket msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'pollsapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['pollsapp.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'pollsapp.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ] + (['pollsapp.renderers.MessagePackParser'] if find_spec('msgpack') else []),
     # 'DEFAULT_PERMISSION_CLASSES': [
     #    'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     # ]
@@ -136,6 +161,33 @@ DATABASES = {
     }
 }
 
+# Cache for serialized polls (pollsapp.cache). Local memory is per process;
+# point 'default' at a shared backend (e.g. memcached) to share it between workers.
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'polls'),
+    }
+}
+
+POLL_CACHE_TIMEOUT = int(os.environ.get('POLL_CACHE_TIMEOUT', 300))
+
+# Per-process cache of token -> user and user -> permissions lookups
+POLLS_AUTH_CACHE_SIZE = int(os.environ.get('POLLS_AUTH_CACHE_SIZE', 10000))
+POLLS_AUTH_CACHE_TIMEOUT = int(os.environ.get('POLLS_AUTH_CACHE_TIMEOUT', 60))
+# Cache alias holding user/permission versions that invalidate the auth caches of all workers; use a shared cache
+POLLS_AUTH_VERSION_CACHE = os.environ.get('POLLS_AUTH_VERSION_CACHE', 'default')
+
+# Most submissions or favorites accepted by one batch request
+POLLS_BATCH_LIMIT = int(os.environ.get('POLLS_BATCH_LIMIT', 500))
+
+# archive_polls: submissions of polls archived for POLLS_ARCHIVE_COLD_AFTER_DAYS move to cold storage,
+# polls archived for POLLS_ARCHIVE_RETENTION_DAYS are deleted (0 keeps them)
+POLLS_ARCHIVE_COLD_AFTER_DAYS = int(os.environ.get('POLLS_ARCHIVE_COLD_AFTER_DAYS', 30))
+POLLS_ARCHIVE_RETENTION_DAYS = int(os.environ.get('POLLS_ARCHIVE_RETENTION_DAYS', 365))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -181,6 +233,31 @@ import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# Read replicas (comma-separated database URLs): reads of safe requests go to a replica, writes to 'default'.
+# A user who just wrote reads from 'default' for POLLS_REPLICA_STICKY_SECONDS.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+POLLS_REPLICA_STICKY_SECONDS = int(os.environ.get('POLLS_REPLICA_STICKY_SECONDS', 5))
+# Cache alias holding those pins; it must be shared by all workers (not LocMemCache)
+POLLS_REPLICA_PIN_CACHE = os.environ.get('POLLS_REPLICA_PIN_CACHE', 'default')
+
+for index, url in enumerate(DATABASE_REPLICA_URLS):
+    DATABASES['replica{}'.format(index + 1)] = dict(dj_database_url.parse(url, conn_max_age=500), TEST={'MIRROR': 'default'})
+
+if DATABASE_REPLICA_URLS:
+    DATABASE_ROUTERS = ['pollsapp.routers.ReplicaRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+                      'pollsapp.routers.ReplicaMiddleware')
+
+# In-process Postgres connection pool shared by the threads of a worker, instead of a persistent connection per thread
+if os.environ.get('POLLS_DB_POOL', '') == 'True':
+    for database in DATABASES.values():
+        if database['ENGINE'] in ('django.db.backends.postgresql', 'django.db.backends.postgresql_psycopg2'):
+            database.update(ENGINE='pollsapp.db.postgresql', CONN_MAX_AGE=0, POOL={
+                'MAX_SIZE': int(os.environ.get('POLLS_DB_POOL_SIZE', 10)),
+                'TIMEOUT': int(os.environ.get('POLLS_DB_POOL_TIMEOUT', 10)),
+                'CHECK_AFTER': int(os.environ.get('POLLS_DB_POOL_CHECK_AFTER', 30)),
+            })
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
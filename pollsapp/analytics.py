@@ -0,0 +1,202 @@
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+
+from .cache import LRUCache
+from .models import Answer, Question, SubmittedPoll
+
+ANALYTICS_CHUNK_SIZE = 100000
+
+columns_cache = LRUCache(getattr(settings, 'POLLS_ANALYTICS_CACHE_SIZE', 16))
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+class PollColumns:
+    """
+    Columnar form of a poll's answers: one array per question, indexed like `submission_ids`.
+    Choice questions hold the option bitmask (Answer.selection, 0 = unanswered),
+    numeric questions the value (NaN = unanswered).
+    """
+    def __init__(self, poll):
+        self.questions = {question.id: question for question in poll.questions.prefetch_related('options')}
+        self.submission_ids = np.fromiter(
+            SubmittedPoll.objects.filter(poll=poll).order_by('id').values_list('id', flat=True).iterator(),
+            dtype=np.int64)
+        self.columns = {}
+
+        size = len(self.submission_ids)
+        for question in self.questions.values():
+            if question.type in Question.TALLIED_TYPES:
+                self.columns[question.id] = np.zeros(size, dtype=np.int64)
+            elif question.type == Question.QuestionChoice.NUMERIC_INPUT:
+                self.columns[question.id] = np.full(size, np.nan)
+
+        answers = (Answer.objects.filter(question_id__in=list(self.columns))
+                   .values_list('submitted_poll_id', 'question_id', 'selection', 'number')
+                   .iterator(chunk_size=ANALYTICS_CHUNK_SIZE))
+        while self.load_chunk(answers):
+            pass
+
+        # manji tip gdje bitmaska stane (vecina pitanja ima < 8 opcija)
+        for question_id, column in self.columns.items():
+            if column.dtype == np.int64:
+                self.columns[question_id] = column.astype(np.min_scalar_type(int(column.max(initial=0))))
+
+    def load_chunk(self, answers):
+        rows = list(islice(answers, ANALYTICS_CHUNK_SIZE))
+        if not rows:
+            return False
+
+        submitted, question_ids, selections, numbers = zip(*rows)
+        submitted = np.array(submitted, dtype=np.int64)
+        question_ids = np.array(question_ids, dtype=np.int64)
+        selections = np.array([selection or 0 for selection in selections], dtype=np.int64)
+        numbers = np.array([number if number is not None else np.nan for number in numbers], dtype=np.float64)
+
+        # odgovori na predaje spremljene nakon dohvata id-eva predaja se preskacu
+        positions = np.searchsorted(self.submission_ids, submitted)
+        known = positions < len(self.submission_ids)
+        known[known] = self.submission_ids[positions[known]] == submitted[known]
+
+        for question_id, column in self.columns.items():
+            selected = known & (question_ids == question_id)
+            column[positions[selected]] = selections[selected] if column.dtype == np.int64 else numbers[selected]
+        return True
+
+    def question(self, question_id):
+        question = self.questions.get(question_id)
+        if question is None or question_id not in self.columns:
+            raise AnalyticsError('Question {} is not a choice or numeric question of this poll.'.format(question_id))
+        return question
+
+    def option_matrix(self, question_id, mask):
+        """
+        Boolean matrix (respondents x options) of the options picked by the filtered respondents.
+        """
+        options = list(self.question(question_id).options.all())
+        bits = np.array([1 << option.position for option in options], dtype=np.int64)
+        column = self.columns[question_id][mask].astype(np.int64)
+        return options, (column[:, None] & bits) != 0
+
+    def filter_mask(self, conditions):
+        """
+        `conditions` are (question_id, condition) pairs: a list of option positions for choice questions
+        (respondent picked any of them) or a (minimum, maximum) range for numeric questions.
+        """
+        mask = np.ones(len(self.submission_ids), dtype=bool)
+        for question_id, condition in conditions:
+            question = self.question(question_id)
+            column = self.columns[question_id]
+            if question.type in Question.TALLIED_TYPES:
+                if isinstance(condition, tuple):
+                    raise AnalyticsError('Question {} needs option positions, not a range.'.format(question_id))
+                positions = {option.position for option in question.options.all()}
+                unknown = sorted(set(condition) - positions)
+                if unknown:
+                    raise AnalyticsError('Question {} has no options at positions {}.'.format(question_id, unknown))
+                bits = sum(1 << position for position in set(condition))
+                mask &= (column.astype(np.int64) & bits) != 0
+            else:
+                if not isinstance(condition, tuple):
+                    raise AnalyticsError('Question {} needs a min..max range.'.format(question_id))
+                minimum, maximum = condition
+                with np.errstate(invalid='ignore'):
+                    mask &= (column >= (minimum if minimum is not None else -np.inf)) & \
+                            (column <= (maximum if maximum is not None else np.inf))
+        return mask
+
+    def distribution(self, question_id, mask):
+        question = self.question(question_id)
+        if question.type == Question.QuestionChoice.NUMERIC_INPUT:
+            values = self.columns[question_id][mask]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                return {'count': 0}
+            p25, p50, p75, p95 = np.percentile(values, [25, 50, 75, 95])
+            return {'count': int(len(values)), 'mean': float(values.mean()), 'std': float(values.std()),
+                    'min': float(values.min()), 'max': float(values.max()),
+                    'p25': float(p25), 'p50': float(p50), 'p75': float(p75), 'p95': float(p95)}
+
+        options, matrix = self.option_matrix(question_id, mask)
+        respondents = int(matrix.any(axis=1).sum())
+        counts = matrix.sum(axis=0)
+        return {
+            'respondents': respondents,
+            'options': [{'position': option.position, 'label': option.label, 'count': int(count),
+                         'percent': percent(count, respondents)}
+                        for option, count in zip(options, counts)],
+        }
+
+    def crosstab(self, question_id, by_id, mask):
+        rows, row_matrix = self.option_matrix(question_id, mask)
+        columns, column_matrix = self.option_matrix(by_id, mask)
+        counts = row_matrix.T.astype(np.int64) @ column_matrix.astype(np.int64)
+        column_totals = column_matrix.sum(axis=0)
+        return {
+            'rows': [option.label for option in rows],
+            'columns': [option.label for option in columns],
+            'counts': counts.tolist(),
+            # postotak ispitanika iz stupca (odgovor na `by`) koji su odabrali opciju iz retka
+            'column_percents': [[percent(count, total) for count, total in zip(row, column_totals)] for row in counts],
+        }
+
+
+def percent(count, total):
+    return round(float(count) * 100 / total, 2) if total else 0.0
+
+
+def poll_columns(poll):
+    """
+    Columns of the poll, rebuilt only when the poll version changed (new submissions, edits).
+    """
+    cached = columns_cache.get(poll.pk)
+    if cached is not None and cached[0] == poll.version:
+        return cached[1]
+
+    columns = PollColumns(poll)
+    columns_cache.set(poll.pk, (poll.version, columns))
+    return columns
+
+
+def parse_conditions(values):
+    """
+    Parses ?where= values: `<question>:<position>,<position>` or `<question>:<min>..<max>` (either end optional).
+    """
+    conditions = []
+    for value in values:
+        try:
+            question_id, condition = value.split(':', 1)
+            if '..' in condition:
+                minimum, maximum = condition.split('..', 1)
+                condition = (float(minimum) if minimum else None, float(maximum) if maximum else None)
+            else:
+                condition = [int(position) for position in condition.split(',')]
+            conditions.append((int(question_id), condition))
+        except ValueError:
+            raise AnalyticsError('Invalid condition "{}".'.format(value))
+    return conditions
+
+
+def analyze(poll, question_id, by_id=None, where=()):
+    columns = poll_columns(poll)
+    mask = columns.filter_mask(parse_conditions(where))
+    question = columns.question(question_id)
+
+    data = {
+        'poll': poll.pk,
+        'submissions': int(len(columns.submission_ids)),
+        'matched': int(mask.sum()),
+        'question': {'id': question.id, 'content': question.content, 'type': question.type},
+        'results': columns.distribution(question_id, mask),
+    }
+    if by_id is not None:
+        by = columns.question(by_id)
+        if Question.QuestionChoice.NUMERIC_INPUT in (question.type, by.type):
+            raise AnalyticsError('Crosstabs need two choice questions.')
+        data['by'] = {'id': by.id, 'content': by.content, 'type': by.type}
+        data['crosstab'] = columns.crosstab(question_id, by_id, mask)
+    return data
@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models.signals import post_migrate
 
 
 class PollsappConfig(AppConfig):
     name = 'pollsapp'
+
+    def ready(self):
+        from .authentication import connect_signals
+        from .search import install_search_index
+        post_migrate.connect(install_search_index, sender=self)
+        connect_signals()
+
+        if getattr(settings, 'POLLS_SUBMISSION_BUFFER', ''):
+            from .buffer import start_submission_flusher
+            request_started.connect(start_submission_flusher, dispatch_uid='pollsapp.buffer')
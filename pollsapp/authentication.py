@@ -0,0 +1,146 @@
+import copy
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import LRUCache
+
+AUTH_CACHE_SIZE = getattr(settings, 'POLLS_AUTH_CACHE_SIZE', 10000)
+AUTH_CACHE_TIMEOUT = getattr(settings, 'POLLS_AUTH_CACHE_TIMEOUT', 60)
+# cache s verzijama korisnika i permisija; da bi invalidacija dosla do svih workera mora biti zajednicki (npr. Redis)
+AUTH_VERSION_CACHE = getattr(settings, 'POLLS_AUTH_VERSION_CACHE', DEFAULT_CACHE_ALIAS)
+PERMISSIONS_VERSION_KEY = 'pollsapp:auth:permissions'
+
+# token key -> (user, token, verzija korisnika), user id -> (skup permisija, verzije korisnika i permisija)
+token_cache = LRUCache(AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TIMEOUT)
+permission_cache = LRUCache(AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TIMEOUT)
+
+
+def user_version_key(pk):
+    return 'pollsapp:auth:user:{}'.format(pk)
+
+
+def versions(pk):
+    """
+    Returns the shared (user, permissions) versions; a cached entry is valid only while they are unchanged.
+    """
+    keys = [user_version_key(pk), PERMISSIONS_VERSION_KEY]
+    found = caches[AUTH_VERSION_CACHE].get_many(keys)
+    return tuple(found.get(key) for key in keys)
+
+
+def bump_version(key):
+    # nova verzija nema timeout - istek bi vratio verziju None i valjanost unosa spremljenih prije njenog postavljanja
+    caches[AUTH_VERSION_CACHE].set(key, uuid.uuid4().hex, None)
+
+
+def request_copy(user):
+    # svaki request dobiva svoju kopiju korisnika, pa atributi postavljeni tijekom requesta ne ostaju u cacheu
+    clone = copy.copy(user)
+    clone._state = copy.copy(user._state)
+    clone._state.fields_cache = dict(user._state.fields_cache)
+    return clone
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps token -> user lookups in a per-process TTL/LRU cache.
+    Entries are dropped in every process when the token is deleted (logout) or the user is saved,
+    e.g. after a password change: the user's version in the shared cache changes.
+    """
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None and cached[2] != versions(cached[0].pk)[0]:
+            cached = None
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cached = (user, token, versions(user.pk)[0])
+            token_cache.set(key, cached)
+        user, token, _ = cached
+        return request_copy(user), token
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that keeps each user's permission set in a per-process TTL/LRU cache,
+    dropped in every process when the user's, a group's or a permission's assignments change.
+    """
+    def get_all_permissions(self, user_obj, obj=None):
+        if user_obj.is_active and not user_obj.is_anonymous and obj is None and not hasattr(user_obj, '_perm_cache'):
+            current = versions(user_obj.pk)
+            cached = permission_cache.get(user_obj.pk)
+            if cached is None or cached[1] != current:
+                # verzije procitane prije upita - promjena tijekom upita ostavlja unos nevaljanim
+                cached = (super().get_all_permissions(user_obj), current)
+                permission_cache.set(user_obj.pk, cached)
+            user_obj._perm_cache = cached[0]
+        return super().get_all_permissions(user_obj, obj=obj)
+
+
+def invalidate_user(pk):
+    bump_version(user_version_key(pk))
+    token_cache.delete_where(lambda key, value: value[0].pk == pk)
+    permission_cache.delete(pk)
+
+
+def invalidate_permissions():
+    bump_version(PERMISSIONS_VERSION_KEY)
+    permission_cache.clear()
+
+
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+def user_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+def token_changed(sender, instance, **kwargs):
+    # drugi workeri unos tokena odbacuju po verziji njegovog korisnika
+    bump_version(user_version_key(instance.user_id))
+    token_cache.delete(instance.key)
+
+
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_user(instance.pk)
+    elif pk_set is None:
+        invalidate_permissions()
+    else:
+        for pk in pk_set:
+            invalidate_user(pk)
+
+
+def permissions_changed(sender, **kwargs):
+    # promjena grupe ili permisije moze utjecati na bilo kojeg korisnika
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_permissions()
+
+
+def connect_signals():
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group, Permission
+    from django.contrib.auth.signals import user_logged_out as logged_out
+    from django.db.models.signals import m2m_changed, post_delete, post_save
+    from rest_framework.authtoken.models import Token
+
+    User = get_user_model()
+    for signal in (post_save, post_delete):
+        signal.connect(user_changed, sender=User, dispatch_uid='pollsapp.authentication.user')
+        signal.connect(token_changed, sender=Token, dispatch_uid='pollsapp.authentication.token')
+        signal.connect(permissions_changed, sender=Group, dispatch_uid='pollsapp.authentication.group')
+        signal.connect(permissions_changed, sender=Permission, dispatch_uid='pollsapp.authentication.permission')
+    logged_out.connect(user_logged_out, dispatch_uid='pollsapp.authentication.logout')
+    m2m_changed.connect(user_permissions_changed, sender=User.user_permissions.through,
+                        dispatch_uid='pollsapp.authentication.user_permissions')
+    m2m_changed.connect(user_permissions_changed, sender=User.groups.through,
+                        dispatch_uid='pollsapp.authentication.groups')
+    m2m_changed.connect(permissions_changed, sender=Group.permissions.through,
+                        dispatch_uid='pollsapp.authentication.group_permissions')
@@ -0,0 +1,196 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger("mylogger")
+
+
+class BufferFull(Exception):
+    pass
+
+
+class SubmissionBuffer:
+    """
+    Durable local queue of validated submissions (a SQLite file in WAL mode) that is flushed to the database
+    in batches. Entries are removed only after their submissions are committed and the flushed position is
+    kept in SubmissionBufferCheckpoint, so a restarted process replays what is left without saving anything twice.
+    """
+    def __init__(self, path, name=None, limit=10000, batch_size=500, interval=1.0):
+        self.path = os.path.abspath(path)
+        self.name = name or '{}:{}'.format(socket.gethostname(), self.path)
+        self.limit = limit
+        self.batch_size = batch_size
+        self.interval = interval
+        self.local = threading.local()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.flushed = 0
+        self.last_flush_at = None
+        self.last_flush_ms = 0.0
+        self.last_error = None
+
+        db = self.connection()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS submissions ('
+                   'id INTEGER PRIMARY KEY AUTOINCREMENT, poll_id INTEGER NOT NULL, user_id INTEGER, '
+                   'answers TEXT NOT NULL, queued_at REAL NOT NULL)')
+
+    def connection(self):
+        # sqlite3 konekcija smije se koristiti samo u dretvi koja ju je otvorila
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    def enqueue(self, poll_id, user_id, answers):
+        """
+        Durably queues one submission; raises BufferFull when `limit` submissions are already waiting.
+        """
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            pending, = db.execute('SELECT COUNT(*) FROM submissions').fetchone()
+            if pending >= self.limit:
+                raise BufferFull()
+            cursor = db.execute('INSERT INTO submissions (poll_id, user_id, answers, queued_at) VALUES (?, ?, ?, ?)',
+                                (poll_id, user_id, json.dumps(answers), time.time()))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+        if pending + 1 >= self.batch_size:
+            self.wakeup.set()
+        return cursor.lastrowid
+
+    def flush(self):
+        """
+        Saves the next batch of queued submissions and returns how many entries it consumed.
+        """
+        from .models import SubmissionBufferCheckpoint
+
+        db = self.connection()
+        with self.flush_lock:
+            start = time.perf_counter()
+            with transaction.atomic():
+                checkpoint, _ = SubmissionBufferCheckpoint.objects.get_or_create(buffer=self.name)
+                # zakljucani checkpoint - procesi koji dijele datoteku ne flushaju iste unose
+                checkpoint = SubmissionBufferCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+
+                sequence = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'submissions'").fetchone()
+                if (sequence[0] if sequence else 0) < checkpoint.flushed_id:
+                    logger.warning('Submission buffer %s was recreated, replaying it from the start', self.name)
+                    checkpoint.flushed_id = 0
+
+                rows = db.execute('SELECT id, poll_id, user_id, answers, queued_at FROM submissions '
+                                  'WHERE id > ? ORDER BY id LIMIT ?', (checkpoint.flushed_id, self.batch_size)).fetchall()
+                if rows:
+                    self.save(rows)
+                    checkpoint.flushed_id = rows[-1][0]
+                checkpoint.save(update_fields=['flushed_id'])
+
+            db.execute('DELETE FROM submissions WHERE id <= ?', (checkpoint.flushed_id,))
+            self.flushed += len(rows)
+            self.last_flush_at = time.time()
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+        return len(rows)
+
+    def save(self, rows):
+        from .models import Poll, Question, SubmittedPoll
+
+        # ankete i korisnici obrisani nakon prijema odnose i svoje submissione
+        polls = set(Poll._base_manager.filter(pk__in={row[1] for row in rows}).values_list('pk', flat=True))
+        users = set(get_user_model()._base_manager.filter(pk__in={row[2] for row in rows if row[2] is not None})
+                    .values_list('pk', flat=True))
+        entries = [(poll_id, user_id, json.loads(answers), queued_at) for _, poll_id, user_id, answers, queued_at in rows
+                   if poll_id in polls and (user_id is None or user_id in users)]
+
+        question_ids = {answer['question_id'] for _, _, answers, _ in entries for answer in answers}
+        questions = Question.objects.filter(poll_id__in=polls).prefetch_related('options').in_bulk(question_ids)
+        SubmittedPoll.objects.bulk_submit([
+            (SubmittedPoll(poll_id=poll_id, user_id=user_id,
+                           answered_at=datetime.datetime.fromtimestamp(queued_at, tz=datetime.timezone.utc)), answers)
+            for poll_id, user_id, answers, queued_at in entries
+        ], questions)
+
+    def drain(self):
+        flushed = 0
+        while True:
+            count = self.flush()
+            flushed += count
+            if count < self.batch_size:
+                return flushed
+
+    def stats(self):
+        pending, oldest = self.connection().execute('SELECT COUNT(*), MIN(queued_at) FROM submissions').fetchone()
+        return {
+            'pending': pending,
+            'limit': self.limit,
+            'flush_lag_seconds': time.time() - oldest if oldest is not None else 0.0,
+            'flushed': self.flushed,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_ms': self.last_flush_ms,
+            'last_error': self.last_error,
+        }
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name='submission-buffer-flusher', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.drain()
+                self.last_error = None
+            except Exception as e:
+                # unosi ostaju u bufferu i ponovno se pokusavaju u sljedecem ciklusu
+                logger.exception('Flushing submission buffer %s failed', self.name)
+                self.last_error = repr(e)
+            finally:
+                close_old_connections()
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Returns the configured submission buffer, or None when submissions are saved synchronously.
+    """
+    global _buffer
+    path = getattr(settings, 'POLLS_SUBMISSION_BUFFER', '')
+    if not path:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = SubmissionBuffer(
+                path,
+                name=getattr(settings, 'POLLS_SUBMISSION_BUFFER_NAME', None),
+                limit=getattr(settings, 'POLLS_SUBMISSION_BUFFER_LIMIT', 10000),
+                batch_size=getattr(settings, 'POLLS_SUBMISSION_FLUSH_BATCH', 500),
+                interval=getattr(settings, 'POLLS_SUBMISSION_FLUSH_INTERVAL', 1.0),
+            )
+    return _buffer
+
+
+def start_submission_flusher(sender, **kwargs):
+    # pokrece se s prvim requestom - naredbe poput migrate ne smiju flushati
+    from django.core.signals import request_started
+
+    request_started.disconnect(start_submission_flusher, dispatch_uid='pollsapp.buffer')
+    get_buffer().start()
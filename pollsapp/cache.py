@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+POLL_CACHE_ALIAS = getattr(settings, 'POLL_CACHE_ALIAS', 'default')
+POLL_CACHE_TIMEOUT = getattr(settings, 'POLL_CACHE_TIMEOUT', 300)
+# s replikama se promijenjena anketa ne sprema u cache dok ju replike ne sustignu
+POLL_CACHE_REFILL_DELAY = (getattr(settings, 'POLLS_REPLICA_STICKY_SECONDS', 5)
+                           if getattr(settings, 'DATABASE_REPLICA_URLS', None) else 0)
+
+
+def poll_cache():
+    return caches[POLL_CACHE_ALIAS]
+
+
+def poll_key(pk):
+    return 'pollsapp:poll:{}'.format(pk)
+
+
+def get_polls(pks):
+    """
+    Returns cached serialized polls keyed by poll id; polls that are not cached are left out.
+    """
+    keys = {poll_key(pk): pk for pk in pks}
+    return {keys[key]: data for key, data in poll_cache().get_many(keys.keys()).items()}
+
+
+def dirty_key(pk):
+    return 'pollsapp:poll-dirty:{}'.format(pk)
+
+
+def set_polls(data):
+    if POLL_CACHE_REFILL_DELAY:
+        dirty = poll_cache().get_many([dirty_key(pk) for pk in data])
+        data = {pk: poll for pk, poll in data.items() if dirty_key(pk) not in dirty}
+    poll_cache().set_many({poll_key(pk): poll for pk, poll in data.items()}, POLL_CACHE_TIMEOUT)
+
+
+def invalidate_poll(pk):
+    poll_cache().delete(poll_key(pk))
+    if POLL_CACHE_REFILL_DELAY:
+        poll_cache().set(dirty_key(pk), True, POLL_CACHE_REFILL_DELAY)
+
+
+class LRUCache:
+    """
+    Bounded in-process cache for values that should not be pickled into Django's cache (e.g. NumPy arrays).
+    With `ttl` set, entries older than `ttl` seconds are treated as missing.
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, expires = self.entries[key]
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, _) in self.entries.items() if predicate(key, value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
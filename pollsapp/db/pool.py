@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections shared by the threads of one process.
+    Connections idle for longer than `check_after` seconds are health-checked before they are handed out,
+    and broken ones are replaced by new connections.
+    """
+    def __init__(self, connect, check, max_size=10, timeout=10, check_after=30):
+        self.connect = connect
+        self.check = check
+        self.timeout = timeout
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+
+    def get(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError('No database connection available within {} seconds'.format(self.timeout))
+        try:
+            while True:
+                with self.lock:
+                    connection, returned_at = self.idle.pop() if self.idle else (None, None)
+                if connection is None:
+                    return self.connect()
+                if time.monotonic() - returned_at < self.check_after or self.check(connection):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, reuse=True):
+        try:
+            if reuse:
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            else:
+                self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            self.discard(connection)
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Takes connections of a Django database backend from a per-process ConnectionPool and returns them
+    when Django closes the connection (end of request with CONN_MAX_AGE = 0), instead of reconnecting.
+    Configured with the POOL key of the database settings: MAX_SIZE, TIMEOUT and CHECK_AFTER.
+    """
+    def get_pool(self, conn_params):
+        with _pools_lock:
+            if self.alias not in _pools:
+                options = self.settings_dict.get('POOL', {})
+                _pools[self.alias] = ConnectionPool(
+                    lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params),
+                    self.check_connection,
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 10),
+                    check_after=options.get('CHECK_AFTER', 30),
+                )
+            return _pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        return self.get_pool(conn_params).get()
+
+    def check_connection(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        # veza s otvorenom transakcijom ili greskom ne vraca se u pool
+        reuse = not (self.in_atomic_block or self.errors_occurred or not self.get_autocommit())
+        _pools[self.alias].put(self.connection, reuse=reuse)
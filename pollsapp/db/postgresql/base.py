@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    PostgreSQL backend with an in-process connection pool (ENGINE 'pollsapp.db.postgresql').
+    """
+    def check_connection(self, connection):
+        return not connection.closed and super().check_connection(connection)
@@ -0,0 +1,71 @@
+import csv
+from collections import defaultdict
+from itertools import islice
+
+from .models import Answer, SubmittedPoll
+from .renderers import dumps
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so csv.writer can feed a streaming response.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_submissions(poll, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields (submission_id, answered_at, user_email, answers) for every submission of the poll,
+    where answers maps question ids to answer text. Only one chunk of submissions is held in memory.
+    """
+    submissions = (SubmittedPoll.objects.filter(poll=poll)
+                   .order_by('id')
+                   .values_list('id', 'answered_at', 'user__email')
+                   .iterator(chunk_size=chunk_size))
+
+    while True:
+        chunk = list(islice(submissions, chunk_size))
+        if not chunk:
+            return
+
+        answers = defaultdict(dict)
+        chunk_answers = (Answer.objects
+                         .filter(submitted_poll__poll=poll,
+                                 submitted_poll_id__gte=chunk[0][0],
+                                 submitted_poll_id__lte=chunk[-1][0])
+                         .values_list('submitted_poll_id', 'question_id', 'answer')
+                         .iterator(chunk_size=chunk_size))
+        for submitted_poll_id, question_id, answer in chunk_answers:
+            answers[submitted_poll_id][question_id] = answer
+
+        for submitted_poll_id, answered_at, user in chunk:
+            yield submitted_poll_id, answered_at, user, answers.pop(submitted_poll_id, {})
+
+
+def csv_rows(poll):
+    questions = list(poll.questions.order_by('id').values_list('id', 'content'))
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(['submission', 'answered_at', 'user'] + [content for _, content in questions])
+    for submitted_poll_id, answered_at, user, answers in iter_submissions(poll):
+        yield writer.writerow([submitted_poll_id, answered_at.isoformat(), user or '']
+                              + [answers.get(question_id, '') for question_id, _ in questions])
+
+
+def ndjson_rows(poll):
+    for submitted_poll_id, answered_at, user, answers in iter_submissions(poll):
+        yield dumps({
+            'id': submitted_poll_id,
+            'answered_at': answered_at.isoformat(),
+            'user': user,
+            'answers': answers,
+        }) + b'\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_rows, 'text/csv'),
+    'ndjson': (ndjson_rows, 'application/x-ndjson'),
+}
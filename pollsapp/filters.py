@@ -0,0 +1,18 @@
+from rest_framework import filters
+
+from .search import get_search_backend, search_tokens
+
+
+class PollSearchFilter(filters.SearchFilter):
+    """
+    ?search= over the full-text index of poll title and description, with prefix matching and ranking.
+    Falls back to SearchFilter (icontains) when the database has no full-text backend.
+    """
+    def filter_queryset(self, request, queryset, view):
+        tokens = search_tokens(self.get_search_terms(request))
+        backend = get_search_backend(queryset.db)
+        if not tokens or backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        # MATCH je podupit bez limita, pa filteri (arhivirane ankete, favoriti, ?user=) ne gube pogotke
+        return backend.search(queryset, tokens)
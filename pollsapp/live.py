@@ -0,0 +1,174 @@
+import asyncio
+import io
+import json
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("mylogger")
+
+LIVE_RESULTS_PATH = re.compile(r'^/api/v1/polls/(?P<pk>\d+)/live/$')
+HEARTBEAT_SECONDS = getattr(settings, 'POLLS_LIVE_HEARTBEAT', 15)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class InMemoryBroker:
+    """
+    In-process pub/sub of live result events. Publishing is thread-safe, so sync views can publish
+    to coroutines waiting on the event loop. Only subscribers in the same process receive events;
+    multi-process deployments need a broker backed by a shared channel (e.g. Redis pub/sub).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, poll_id):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[poll_id].add((asyncio.get_event_loop(), queue))
+        return queue
+
+    def unsubscribe(self, poll_id, queue):
+        with self.lock:
+            self.subscribers[poll_id] = {(loop, q) for loop, q in self.subscribers[poll_id] if q is not queue}
+            if not self.subscribers[poll_id]:
+                del self.subscribers[poll_id]
+
+    def publish(self, poll_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(poll_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(offer, queue, event)
+
+
+def offer(queue, event):
+    # spori klijent ne smije blokirati ostale - najstariji dogadaj se odbacuje
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'POLLS_LIVE_BROKER', 'pollsapp.live.InMemoryBroker'))()
+    return _broker
+
+
+def publish_results(poll_id, counts, numbers, submissions=1):
+    """
+    Publishes the tally increments of saved submissions; `counts` and `numbers` come from QuestionTally.objects.record.
+    """
+    questions = defaultdict(dict)
+    for (question_id, option), count in counts.items():
+        questions[str(question_id)].setdefault('options', {})[option] = count
+    for question_id, values in numbers.items():
+        questions[str(question_id)]['values'] = values
+
+    try:
+        get_broker().publish(poll_id, {'poll': poll_id, 'submissions': submissions, 'questions': questions})
+    except Exception:
+        logger.exception('Publishing live results of poll %s failed', poll_id)
+
+
+def results_snapshot(poll_id):
+    from .models import Poll
+    from .serializers import PollResultsSerializer
+
+    try:
+        queryset = Poll.objects.prefetch_related('questions', 'questions__tallies', 'questions__numeric_summary')
+        poll = queryset.filter(pk=poll_id).first()
+        return PollResultsSerializer(poll).data if poll is not None else None
+    finally:
+        close_old_connections()
+
+
+def cors_headers(scope):
+    """
+    CORS headers CorsMiddleware would add to a Django response to the same request.
+    """
+    from corsheaders.middleware import CorsMiddleware
+
+    # stream ne prolazi kroz Django middleware pa se zaglavlja racunaju na praznom odgovoru
+    response = CorsMiddleware().process_response(ASGIRequest(scope, io.BytesIO()), HttpResponse())
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.items()
+            if name.lower().startswith('access-control-') or name.lower() == 'vary']
+
+
+def sse_message(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data)).encode()
+
+
+async def live_results(scope, receive, send, poll_id):
+    """
+    Server-Sent Events stream of a poll's results: a full `results` snapshot, then one `tally` event per submission.
+    """
+    cors = await sync_to_async(cors_headers)(scope)
+    snapshot = await sync_to_async(results_snapshot)(poll_id)
+    if snapshot is None:
+        await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')] + cors})
+        await send({'type': 'http.response.body', 'body': b'Not found.'})
+        return
+
+    broker = get_broker()
+    queue = broker.subscribe(poll_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ] + cors,
+        })
+        await send({'type': 'http.response.body', 'body': sse_message('results', snapshot), 'more_body': True})
+
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if next_event in done:
+                body = sse_message('tally', next_event.result())
+            else:
+                next_event.cancel()
+                if disconnected.done():
+                    break
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broker.unsubscribe(poll_id, queue)
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def live_results_application(django_application):
+    """
+    ASGI application serving live result streams and handing every other request to Django.
+    """
+    async def application(scope, receive, send):
+        match = LIVE_RESULTS_PATH.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        # CORS preflight odgovara CorsMiddleware u Djangu
+        if match is None or scope['method'] == 'OPTIONS':
+            return await django_application(scope, receive, send)
+        return await live_results(scope, receive, send, int(match.group('pk')))
+
+    return application
@@ -0,0 +1,41 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pollsapp.models import Poll, SubmissionArchive, SubmittedPoll
+
+
+class Command(BaseCommand):
+    help = ('Moves submissions of polls archived longer than --cold-after days into compressed cold storage '
+            'and purges polls archived longer than --retention days')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cold-after', type=int, default=getattr(settings, 'POLLS_ARCHIVE_COLD_AFTER_DAYS', 30))
+        parser.add_argument('--retention', type=int, default=getattr(settings, 'POLLS_ARCHIVE_RETENTION_DAYS', 365),
+                            help='0 keeps archived polls forever')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+
+        purged = 0
+        if options['retention']:
+            expired = Poll.objects.get_archived().filter(archived_at__lt=now - datetime.timedelta(days=options['retention']))
+            while True:
+                pks = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                purged += len(pks)
+                Poll.objects.purge(pks, batch_size=batch_size)
+
+        cold = (Poll.objects.get_archived()
+                .filter(archived_at__lt=now - datetime.timedelta(days=options['cold_after']))
+                .filter(pk__in=SubmittedPoll.objects.values('poll')))
+        moved = 0
+        for pk in cold.order_by('pk').values_list('pk', flat=True).iterator():
+            moved += SubmissionArchive.objects.freeze(pk, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS('Purged {} polls, moved {} submissions to cold storage'.format(purged, moved)))
@@ -0,0 +1,160 @@
+import json
+import math
+import platform
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from pollsapp.models import CustomUser, Poll, Question
+
+BENCHMARK_USERNAME = 'benchmark'
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(int(math.ceil(percent / 100.0 * len(ordered))) - 1, 0)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles and query counts of the polls API (run against a seeded database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Run only the given scenario (can be repeated)')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare against results JSON from an earlier run')
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help='Fail if p95 of any scenario is this many percent slower than the baseline')
+
+    def handle(self, *args, **options):
+        poll = Poll.objects.filter(questions__isnull=False).order_by('-id').first()
+        if poll is None:
+            raise CommandError('No polls with questions found, run seed_polls first')
+
+        self.client = self.benchmark_client()
+        self.own_poll = self.benchmark_poll(poll)
+        self.poll = poll
+
+        scenarios = self.scenarios()
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - scenarios.keys()
+            if unknown:
+                raise CommandError('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+            scenarios = {name: scenarios[name] for name in options['scenarios']}
+
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'iterations': options['iterations'],
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'polls': Poll.objects.count(),
+            },
+            'scenarios': {},
+        }
+        for name, request in scenarios.items():
+            results['scenarios'][name] = self.measure(request, options['iterations'], options['warmup'])
+            self.report(name, results['scenarios'][name])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['max_regression'])
+
+    def benchmark_client(self):
+        user, created = CustomUser.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={'email': 'benchmark@example.com', 'is_staff': True, 'is_superuser': True})
+        if created:
+            user.set_unusable_password()
+            user.save()
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(SERVER_NAME='localhost', HTTP_AUTHORIZATION='Token {}'.format(token.key))
+
+    def benchmark_poll(self, template):
+        user = CustomUser.objects.get(username=BENCHMARK_USERNAME)
+        poll = Poll.objects.filter(user=user).first()
+        if poll is None:
+            questions = list(template.questions.values('id', 'content', 'choices', 'required', 'type'))
+            poll = Poll.objects.create(user, {'title': 'Benchmark poll', 'questions': questions})
+        return poll
+
+    def scenarios(self):
+        poll_url = '/api/v1/polls/{}/'.format(self.poll.id)
+        questions = list(self.poll.questions.values_list('id', 'type', 'choices'))
+        answers = [{'question': question_id, 'answer': choices.split(',')[0] if question_type in Question.TALLIED_TYPES else '42'}
+                   for question_id, question_type, choices in questions]
+        own_questions = list(self.own_poll.questions.values('id', 'content', 'choices', 'required', 'type'))
+
+        return {
+            'list': lambda: self.client.get('/api/v1/polls/'),
+            'retrieve': lambda: self.client.get(poll_url),
+            'favorites': lambda: self.client.get('/api/v1/polls/favorites/'),
+            'archived': lambda: self.client.get('/api/v1/polls/archived/'),
+            'results': lambda: self.client.get(poll_url + 'results/'),
+            'submit': lambda: self.client.post('/api/v1/submitted-polls/', json.dumps({'poll': self.poll.id, 'answers': answers}),
+                                               content_type='application/json'),
+            'update': lambda: self.client.put('/api/v1/polls/{}/'.format(self.own_poll.id),
+                                              json.dumps({'title': 'Benchmark poll', 'questions': own_questions}),
+                                              content_type='application/json'),
+        }
+
+    def measure(self, request, iterations, warmup):
+        for _ in range(warmup):
+            request()
+
+        latencies = []
+        queries = []
+        statuses = set()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = request()
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context))
+            statuses.add(response.status_code)
+
+        return {
+            'statuses': sorted(statuses),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'max_ms': max(latencies),
+            'queries': max(queries),
+        }
+
+    def report(self, name, result):
+        self.stdout.write('{:<10} p50 {:8.2f} ms  p95 {:8.2f} ms  p99 {:8.2f} ms  queries {:4d}  status {}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries'],
+            ','.join(str(status) for status in result['statuses'])))
+
+    def compare(self, results, baseline_path, max_regression):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['scenarios']
+
+        regressions = []
+        self.stdout.write('\nCompared to {}:'.format(baseline_path))
+        for name, result in results['scenarios'].items():
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            self.stdout.write('{:<10} p95 {:+7.1f}%  queries {} -> {}'.format(name, change, before['queries'], result['queries']))
+            if max_regression is not None and change > max_regression:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError('p95 regressed by more than {}% in: {}'.format(max_regression, ', '.join(regressions)))
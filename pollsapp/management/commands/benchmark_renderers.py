@@ -0,0 +1,52 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import prefetch_related_objects
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from pollsapp import renderers
+from pollsapp.management.commands.benchmark_api import percentile
+from pollsapp.models import Poll
+from pollsapp.serializers import PollSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares API renderers and parsers on PollSerializer payloads (run against a seeded database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--polls', type=int, default=500, help='Number of polls in the payload')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        polls = list(Poll.objects.select_related('user').order_by('-id')[:options['polls']])
+        if not polls:
+            raise CommandError('No polls found, run seed_polls first')
+        prefetch_related_objects(polls, 'questions')
+        data = PollSerializer(polls, many=True).data
+
+        candidates = [
+            ('json (DRF)', JSONRenderer(), JSONParser()),
+            ('{} (FastJSON)'.format(renderers.JSON_LIBRARY), renderers.FastJSONRenderer(), renderers.FastJSONParser()),
+        ]
+        if renderers.msgpack is not None:
+            candidates.append(('msgpack', renderers.MessagePackRenderer(), renderers.MessagePackParser()))
+
+        self.stdout.write('{} polls, {} iterations'.format(len(polls), options['iterations']))
+        baseline = None
+        for name, renderer, parser in candidates:
+            render_ms, parse_ms = [], []
+            for _ in range(options['iterations']):
+                start = time.perf_counter()
+                body = renderer.render(data, renderer.media_type, {})
+                render_ms.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                parser.parse(io.BytesIO(body), parser.media_type, {'encoding': 'utf-8'})
+                parse_ms.append((time.perf_counter() - start) * 1000)
+
+            render_p50 = percentile(render_ms, 50)
+            baseline = baseline or render_p50
+            self.stdout.write('{:<18} {:9.1f} KB  render p50 {:8.2f} ms (x{:.1f})  parse p50 {:8.2f} ms'.format(
+                name, len(body) / 1024, render_p50, baseline / render_p50, percentile(parse_ms, 50)))
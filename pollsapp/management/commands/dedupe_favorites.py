@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+
+from pollsapp.models import FavoritePoll
+
+
+class Command(BaseCommand):
+    help = 'Removes repeated favorites of the same user and poll, keeping the oldest one'
+
+    def handle(self, *args, **options):
+        # pokrece se prije migracije jedinstvenog (user, poll) - koristi samo stupce koje tablica ima od pocetka
+        duplicates = list(FavoritePoll.objects.filter(user__isnull=False).values('user_id', 'poll_id')
+                          .annotate(keep=Min('id'), count=Count('id')).filter(count__gt=1).order_by())
+        removed = 0
+        for duplicate in duplicates:
+            removed += (FavoritePoll.objects.filter(user_id=duplicate['user_id'], poll_id=duplicate['poll_id'])
+                        .exclude(pk=duplicate['keep']).delete()[0])
+
+        self.stdout.write(self.style.SUCCESS('Removed {} duplicate favorites'.format(removed)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from pollsapp.models import Answer, Question, QuestionOption
+
+
+class Command(BaseCommand):
+    help = 'Creates question options from choices and fills the structured columns of stored answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Convert only the given poll id (can be repeated)')
+
+    def handle(self, *args, **options):
+        questions = Question.objects.all()
+        if options['polls']:
+            questions = questions.filter(poll_id__in=options['polls'])
+
+        QuestionOption.objects.sync(questions)
+        updated = Answer.objects.encode_stored(questions)
+        self.stdout.write(self.style.SUCCESS('Encoded {} answers'.format(updated)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pollsapp.buffer import get_buffer
+
+
+class Command(BaseCommand):
+    help = 'Saves all submissions waiting in the write-behind submission buffer'
+
+    def handle(self, *args, **options):
+        buffer = get_buffer()
+        if buffer is None:
+            raise CommandError('POLLS_SUBMISSION_BUFFER is not set')
+
+        flushed = buffer.drain()
+        self.stdout.write(self.style.SUCCESS('Flushed {} submissions'.format(flushed)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pollsapp.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of polls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        if backend is None:
+            raise CommandError('Full-text search is not available for this database')
+
+        backend.install()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
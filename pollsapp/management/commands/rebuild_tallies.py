@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from pollsapp.models import Poll, QuestionTally
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds poll result tallies from submitted answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Rebuild only the given poll id (can be repeated)')
+
+    def handle(self, *args, **options):
+        polls = None
+        if options['polls']:
+            polls = Poll._base_manager.filter(pk__in=options['polls'])
+
+        with transaction.atomic():
+            QuestionTally.objects.rebuild(polls)
+            # rezultati su se mozda promijenili pa klijenti ne smiju dobiti 304 za stari ETag
+            (polls if polls is not None else Poll._base_manager.all()).update(
+                version=F('version') + 1, modified_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS('Tallies rebuilt'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from pollsapp.models import Poll
+
+
+class Command(BaseCommand):
+    help = 'Fixes drift of the favorite/submission/question counters of polls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = 0
+        last_pk = 0
+        while True:
+            # svaka serija je zasebni UPDATE, bez dugih zakljucavanja cijele tablice
+            pks = list(Poll._base_manager.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            fixed += Poll.objects.reconcile_counters(pks)
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS('Fixed {} poll counters'.format(fixed)))
@@ -0,0 +1,123 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pollsapp.models import Answer, CustomUser, FavoritePoll, Poll, Question, QuestionOption, QuestionTally, SubmittedPoll
+
+CHOICE_LABELS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta']
+WORDS = ['coffee', 'weather', 'music', 'travel', 'food', 'sports', 'books', 'movies', 'work', 'city']
+
+
+class Command(BaseCommand):
+    help = 'Seeds the database with a synthetic dataset for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--polls', type=int, default=200)
+        parser.add_argument('--questions', type=int, default=10, help='Questions per poll')
+        parser.add_argument('--submissions', type=int, default=10000, help='Total number of submitted polls')
+        parser.add_argument('--favorites', type=int, default=20, help='Favorite polls per user')
+        parser.add_argument('--archived', type=float, default=0.1, help='Share of archived polls')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Submissions written per transaction')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        users = self.create_users(options['users'])
+        polls = self.create_polls(users, options['polls'], options['questions'], options['archived'])
+        self.create_favorites(users, polls, options['favorites'])
+        self.create_submissions(users, polls, options['submissions'])
+
+        self.stdout.write('Rebuilding tallies')
+        QuestionTally.objects.rebuild(Poll._base_manager.filter(pk__in=polls))
+        self.stdout.write('Counting favorites and submissions')
+        for start in range(0, len(polls), 500):
+            Poll.objects.reconcile_counters(polls[start:start + 500])
+        self.stdout.write(self.style.SUCCESS('Seeded {} users, {} polls, {} submissions'.format(
+            len(users), len(polls), options['submissions'])))
+
+    def last_ids(self, model, count):
+        # SQLite ne vraca id-eve iz bulk_create pa se dohvacaju zadnji kreirani retci
+        return sorted(model._base_manager.order_by('-id').values_list('id', flat=True)[:count])
+
+    def create_users(self, count):
+        start = CustomUser.objects.count()
+        users = []
+        for i in range(start, start + count):
+            user = CustomUser(username='seed-user-{}'.format(i), email='seed-user-{}@example.com'.format(i))
+            user.set_unusable_password()
+            users.append(user)
+        CustomUser.objects.bulk_create(users)
+        self.stdout.write('Created {} users'.format(count))
+        return self.last_ids(CustomUser, count)
+
+    def create_polls(self, users, count, questions_per_poll, archived_share):
+        with transaction.atomic():
+            Poll.objects.bulk_create([
+                Poll(title=' '.join(self.random.sample(WORDS, 3)).capitalize(),
+                     description='Synthetic poll about {}'.format(self.random.choice(WORDS)),
+                     premium=self.random.random() < 0.2,
+                     archived=self.random.random() < archived_share,
+                     user_id=self.random.choice(users))
+                for _ in range(count)
+            ])
+            polls = self.last_ids(Poll, count)
+
+            types = list(Question.QuestionChoice.values)
+            Question.objects.bulk_create([
+                Question(poll_id=poll_id,
+                         content='Question {}'.format(i + 1),
+                         type=types[i % len(types)],
+                         choices=','.join(CHOICE_LABELS[:self.random.randint(2, len(CHOICE_LABELS))]),
+                         required=self.random.random() < 0.5)
+                for poll_id in polls for i in range(questions_per_poll)
+            ])
+            QuestionOption.objects.sync(Question.objects.filter(poll_id__in=polls))
+
+        self.stdout.write('Created {} polls with {} questions each'.format(count, questions_per_poll))
+        return polls
+
+    def create_favorites(self, users, polls, per_user):
+        favorites = [FavoritePoll(user_id=user_id, poll_id=poll_id)
+                     for user_id in users
+                     for poll_id in self.random.sample(polls, min(per_user, len(polls)))]
+        FavoritePoll.objects.bulk_create(favorites)
+        self.stdout.write('Created {} favorites'.format(len(favorites)))
+
+    def create_submissions(self, users, polls, count):
+        questions = {}
+        for question in Question.objects.filter(poll_id__in=polls).prefetch_related('options'):
+            questions.setdefault(question.poll_id, []).append(question)
+
+        created = 0
+        while created < count:
+            size = min(self.batch_size, count - created)
+            with transaction.atomic():
+                poll_ids = [self.random.choice(polls) for _ in range(size)]
+                SubmittedPoll.objects.bulk_create([
+                    SubmittedPoll(poll_id=poll_id, user_id=self.random.choice(users) if self.random.random() < 0.7 else None)
+                    for poll_id in poll_ids
+                ])
+                submitted = SubmittedPoll.objects.filter(pk__in=self.last_ids(SubmittedPoll, size)).values_list('id', 'poll_id')
+                answers = []
+                for submitted_poll_id, poll_id in submitted:
+                    for question in questions.get(poll_id, []):
+                        value = self.answer(question)
+                        answers.append(Answer(submitted_poll_id=submitted_poll_id, question=question, answer=value,
+                                              **Answer.structured(question, value)))
+                Answer.objects.bulk_create(answers)
+            created += size
+            self.stdout.write('Created {}/{} submissions'.format(created, count))
+
+    def answer(self, question):
+        choices = question.choice_list
+        if question.type == Question.QuestionChoice.NUMERIC_INPUT:
+            return str(round(self.random.gauss(50, 15), 2))
+        if question.type == Question.QuestionChoice.MULTIPLE_CHOICE:
+            return ','.join(self.random.sample(choices, self.random.randint(1, len(choices))))
+        if question.type in Question.TALLIED_TYPES:
+            return self.random.choice(choices)
+        return ' '.join(self.random.sample(WORDS, 4))
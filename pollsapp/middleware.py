@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("mylogger")
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class EndpointMetrics:
+    """
+    Per-process aggregate of instrumented requests, keyed by endpoint (e.g. `PollViewSet.favorites`).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = self.empty()
+
+    def empty(self):
+        return defaultdict(lambda: {
+            'requests': 0,
+            'over_budget': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'sql_ms': 0.0,
+            'serialize_ms': 0.0,
+            'total_ms': 0.0,
+            'latency_histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        })
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = self.empty()
+
+    def record(self, endpoint, stats, over_budget):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if stats.total_ms <= bound), len(LATENCY_BUCKETS_MS))
+        with self.lock:
+            entry = self.endpoints[endpoint]
+            entry['requests'] += 1
+            entry['over_budget'] += int(over_budget)
+            entry['queries'] += stats.queries
+            entry['max_queries'] = max(entry['max_queries'], stats.queries)
+            entry['sql_ms'] += stats.sql_ms
+            entry['serialize_ms'] += stats.serialize_ms
+            entry['total_ms'] += stats.total_ms
+            entry['latency_histogram'][bucket] += 1
+
+    def snapshot(self):
+        with self.lock:
+            endpoints = {endpoint: dict(entry, latency_histogram=list(entry['latency_histogram']))
+                         for endpoint, entry in self.endpoints.items()}
+        for entry in endpoints.values():
+            requests = entry['requests']
+            entry['avg_queries'] = entry['queries'] / requests
+            entry['avg_sql_ms'] = entry['sql_ms'] / requests
+            entry['avg_serialize_ms'] = entry['serialize_ms'] / requests
+            entry['avg_total_ms'] = entry['total_ms'] / requests
+        return {'latency_buckets_ms': list(LATENCY_BUCKETS_MS) + ['inf'], 'endpoints': endpoints}
+
+
+metrics = EndpointMetrics()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.view_sql_ms = 0.0
+        self.view_ms = 0.0
+        self.render_ms = 0.0
+        self.total_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_ms += (time.perf_counter() - start) * 1000
+
+    @property
+    def serialize_ms(self):
+        # vrijeme u viewu bez SQL-a (serializeri) + renderiranje odgovora
+        return max(self.view_ms - self.view_sql_ms, 0) + self.render_ms
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records query count, SQL time, serialization time and total latency of every request.
+    Numbers are sent back in the Server-Timing header and aggregated per endpoint in `metrics`.
+    Enabled with POLLS_INSTRUMENTATION; requests with more than POLLS_QUERY_BUDGET queries are logged.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'POLLS_QUERY_BUDGET', None)
+
+    def __call__(self, request):
+        stats = request._instrumentation = RequestStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        stats.total_ms = (time.perf_counter() - start) * 1000
+        if getattr(request, '_instrumentation_rendered_at', None):
+            stats.render_ms = (time.perf_counter() - request._instrumentation_rendered_at) * 1000
+
+        endpoint = getattr(request, '_instrumentation_endpoint', 'unresolved')
+        over_budget = self.query_budget is not None and stats.queries > self.query_budget
+        if over_budget:
+            logger.warning('%s %s (%s) ran %d queries, budget is %d',
+                           request.method, request.path, endpoint, stats.queries, self.query_budget)
+            response['X-Query-Budget-Exceeded'] = '{}/{}'.format(stats.queries, self.query_budget)
+
+        metrics.record(endpoint, stats, over_budget)
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.1f};desc="{} queries"'.format(stats.sql_ms, stats.queries),
+            'serialize;dur={:.1f}'.format(stats.serialize_ms),
+            'total;dur={:.1f}'.format(stats.total_ms),
+        ])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentation_endpoint = endpoint_name(request, view_func)
+        request._instrumentation_view_start = (time.perf_counter(), request._instrumentation.sql_ms)
+
+    def process_template_response(self, request, response):
+        # DRF Response se renderira nakon ovog poziva, view je do sada zavrsio
+        started, sql_ms = request._instrumentation_view_start
+        stats = request._instrumentation
+        stats.view_ms = (time.perf_counter() - started) * 1000
+        stats.view_sql_ms = stats.sql_ms - sql_ms
+        request._instrumentation_rendered_at = time.perf_counter()
+        return response
+
+
+def endpoint_name(request, view_func):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__name__)
+
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return '{}.{}'.format(view_class.__name__, actions.get(request.method.lower(), request.method.lower()))
+    return '{}.{}'.format(view_class.__name__, request.method.lower())
@@ -1,10 +1,50 @@
-from django.db import models
+import math
+import zlib
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractUser
-import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.http import Http404
 
+from .cache import invalidate_poll
+from .live import publish_results
+from .renderers import dumps, loads
+from .sketches import DDSketch
+
+def split_choices(value):
+    # izbori i odgovori na MC pitanja spremaju se kao tekst odvojen zarezima
+    if not value:
+        return []
+    return [choice.strip() for choice in value.split(',') if choice.strip()]
+
+
+def delete_in_batches(queryset, batch_size):
+    # svaki DELETE brise najvise batch_size redaka i commita se zasebno - bez dugih zakljucavanja
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model._base_manager.filter(pk__in=pks).delete()[0]
+
+
+def parse_number(value):
+    # float() prihvaca i "inf"/"nan", koji bi pokvarili zbroj i sketch
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
 class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
@@ -17,70 +57,148 @@ class PollManager(models.Manager):
         return super().get_queryset().filter(archived=True)
 
     def get_favorites(self,user):
-        return super().get_queryset().filter(faved_by__user__user_id=user.id).distinct()
+        # jedan join preko FavoritePoll (user, poll) - par je jedinstven pa distinct nije potreban
+        return super().get_queryset().filter(poll__user_id=user.id)
 
     def archive(self, pk, user):
         poll = self.get(pk=pk,user=user)
         poll.archived = True
-        poll.archived_at = datetime.datetime.now()
-        poll.save()
+        poll.archived_at = timezone.now()
+        poll.save(update_fields=['archived', 'archived_at'])
+        self.touch(poll.pk)
+        transaction.on_commit(lambda: invalidate_poll(poll.pk))
 
     def restore(self, pk):
-        poll = self.get(pk=pk,archived=True)
-        poll.archived = False
-        poll.archived_at = None
-        poll.save()
+        with transaction.atomic():
+            # zakljucana anketa - archive_polls ne premjesta submissione ankete koja se upravo vraca
+            poll = self.get_archived().select_for_update().get(pk=pk)
+            poll.archived = False
+            poll.archived_at = None
+            poll.save(update_fields=['archived', 'archived_at'])
+            SubmissionArchive.objects.rehydrate(poll.pk)
+            self.touch(poll.pk)
+        transaction.on_commit(lambda: invalidate_poll(poll.pk))
+
+    def purge(self, pks, batch_size=500):
+        """
+        Deletes polls with their submissions, archived submissions, favorites and questions in bounded batches,
+        children first, so no single DELETE or cascade grows with the number of submissions.
+        """
+        for queryset in (Answer.objects.filter(question__poll_id__in=pks),
+                         SubmittedPoll.objects.filter(poll_id__in=pks),
+                         SubmissionArchive.objects.filter(poll_id__in=pks),
+                         FavoritePoll.objects.filter(poll_id__in=pks),
+                         QuestionTally.objects.filter(question__poll_id__in=pks),
+                         NumericSummary.objects.filter(question__poll_id__in=pks),
+                         QuestionOption.objects.filter(question__poll_id__in=pks),
+                         Question.objects.filter(poll_id__in=pks)):
+            delete_in_batches(queryset, batch_size)
+        deleted, _ = super().get_queryset().filter(pk__in=pks).delete()
+        for pk in pks:
+            transaction.on_commit(lambda pk=pk: invalidate_poll(pk))
+        return deleted
+
+    def touch(self, pk, **counters):
+        # nova verzija ankete mijenja ETag/Last-Modified koje vracaju PollViewSet.retrieve i results
+        super().get_queryset().filter(pk=pk).update(
+            version=F('version') + 1, modified_at=timezone.now(),
+            **{field: F(field) + value for field, value in counters.items()})
+
+    def increment(self, pk, **counters):
+        self.increment_many([pk], **counters)
+
+    def increment_many(self, pks, **counters):
+        # brojaci se mijenjaju atomarno u bazi (F), bez citanja trenutne vrijednosti
+        if pks:
+            super().get_queryset().filter(pk__in=pks).update(**{field: F(field) + value for field, value in counters.items()})
+
+    def reconcile_counters(self, pks):
+        """
+        Recomputes the counter columns of the given polls from their related rows.
+        Returns the number of counters that had drifted.
+        """
+        polls = super().get_queryset().filter(pk__in=pks)
+        fixed = 0
+        for field, model in (('favorite_count', FavoritePoll), ('submission_count', SubmittedPoll), ('question_count', Question)):
+            related = model.objects.filter(poll=OuterRef('pk')).order_by().values('poll').annotate(count=Count('pk'))
+            actual = Coalesce(Subquery(related.values('count')), 0)
+            if model is SubmittedPoll:
+                # submissioni premjesteni u SubmissionArchive i dalje se broje
+                archived = (SubmissionArchive.objects.filter(poll=OuterRef('pk')).order_by().values('poll')
+                            .annotate(count=Sum('count')))
+                actual = actual + Coalesce(Subquery(archived.values('count')), 0)
+            fixed += polls.exclude(**{field: actual}).update(**{field: actual})
+        return fixed
 
     def create(self, user, validated_data):
         questions_data = validated_data.pop('questions')
-        poll = super().create(**validated_data,user=user)
-        for question in questions_data:
-            del question['id']
-            Question.objects.create(poll=poll, **question)
+        with transaction.atomic():
+            poll = super().create(**validated_data,user=user, question_count=len(questions_data))
+            Question.objects.bulk_create([Question(poll=poll, **self.question_fields(q)) for q in questions_data])
+            QuestionOption.objects.sync(poll.questions.all())
 
         return poll
 
     def update(self, instance, validated_data):
-        questions_data = list(validated_data.pop('questions')) # pitanja iz requesta
-        questions = list(instance.questions.all()) # pitanja u bazi
-
-        instance.title = validated_data.get('title', instance.title)
-        instance.description = validated_data.get('description', instance.description)
-        instance.premium = validated_data.get('premium', instance.premium)
-        instance.save()
-        questions_to_delete = []
-
-        for q_instance in questions:
-            found_question = next((q for q in questions_data if q.get('id') == q_instance.id), None)
-            if found_question:
-                # pitanje postoji->update pitanja u bazi
-                # brisanje pitanja iz requesta kako bi ostala samo pitanja koja treba dodati
-                q_instance.content = found_question.get('content', q_instance.content)
-                q_instance.type = found_question.get('type', q_instance.type)
-                q_instance.choices = found_question.get('choices', q_instance.choices)
-                q_instance.required = found_question.get('required', q_instance.required)
-                q_instance.save()
-                questions_data.remove(found_question)
+        questions_data = validated_data.pop('questions') # pitanja iz requesta
 
-            else:
-                # dodajemo q_instance u questions to delete
-                questions_to_delete.append(q_instance)
+        with transaction.atomic():
+            instance.title = validated_data.get('title', instance.title)
+            instance.description = validated_data.get('description', instance.description)
+            instance.premium = validated_data.get('premium', instance.premium)
+            instance.save(update_fields=['title', 'description', 'premium'])
+
+            questions = {q.id: q for q in instance.questions.all()} # pitanja u bazi
+            found_questions = {q['id']: q for q in questions_data if q.get('id') in questions}
+            new_questions = [q for q in questions_data if q.get('id') not in questions]
+
+            # pitanje postoji->update samo promijenjenih polja
+            changed_questions = []
+            changed_fields = set()
+            for pk, found_question in found_questions.items():
+                q_instance = questions[pk]
+                changed = [field for field, value in self.question_fields(found_question).items()
+                           if getattr(q_instance, field) != value]
+                for field in changed:
+                    setattr(q_instance, field, found_question[field])
+                if changed:
+                    changed_questions.append(q_instance)
+                    changed_fields.update(changed)
 
-        for q in questions_data:
-            del q['id']
-            Question.objects.create(poll=instance, **q)
+            if changed_questions:
+                Question.objects.bulk_update(changed_questions, changed_fields)
+            if new_questions:
+                Question.objects.bulk_create([Question(poll=instance, **self.question_fields(q)) for q in new_questions])
 
-        for q in questions_to_delete:
-            q.delete()
+            # pitanja kojih nema u requestu se brisu
+            questions_to_delete = questions.keys() - found_questions.keys()
+            if questions_to_delete:
+                Question.objects.filter(pk__in=questions_to_delete).delete()
+            question_count = len(new_questions) - len(questions_to_delete)
+            self.touch(instance.pk, question_count=question_count)
+            instance.question_count += question_count
+            if new_questions or 'choices' in changed_fields or 'type' in changed_fields:
+                QuestionOption.objects.sync(instance.questions.all())
+
+            transaction.on_commit(lambda: invalidate_poll(instance.pk))
+
+        return instance
+
+    def question_fields(self, question_data):
+        return {field: value for field, value in question_data.items() if field != 'id'}
 
-        return instance        
-     
 
 class Poll(models.Model):
     class Meta:
         permissions = [
             ('archived_polls_administration', 'Can manage archived polls')
         ]
+        indexes = [
+            models.Index(fields=['archived', '-created_at'], name='poll_archived_created_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(archived=False), name='poll_live_created_idx'),
+            models.Index(fields=['-submission_count', '-id'], condition=models.Q(archived=False), name='poll_live_submissions_idx'),
+            models.Index(fields=['-favorite_count', '-id'], condition=models.Q(archived=False), name='poll_live_favorites_idx'),
+        ]
 
     objects = PollManager()
 
@@ -90,19 +208,23 @@ class Poll(models.Model):
     premium = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     archived_at = models.DateTimeField(blank=True, null=True)
+    version = models.PositiveIntegerField(default=1)
+    modified_at = models.DateTimeField(default=timezone.now)
+    # denormalizirani brojaci (PollManager.increment/touch), popravlja ih reconcile_poll_counters
+    favorite_count = models.PositiveIntegerField(default=0)
+    submission_count = models.PositiveIntegerField(default=0)
+    question_count = models.PositiveIntegerField(default=0)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='polls', on_delete=models.CASCADE)
     faved_by = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name="faved_by", through="FavoritePoll")
 
     @property
     def isFavorite(self):
-        if not (hasattr(self, '_isFavorite')):
-            self._isFavorite = False
-        return self._isFavorite
-
+        # is_favorite dolazi iz anotacije upita (vidi PollViewSet.annotateIsFavorite)
+        return getattr(self, 'is_favorite', False)
 
     @isFavorite.setter
     def isFavorite(self, value):
-        self._isFavorite = value
+        self.is_favorite = value
 
 
 class Question(models.Model):
@@ -119,24 +241,618 @@ class Question(models.Model):
     type = models.CharField(max_length=2, choices=QuestionChoice.choices, default=QuestionChoice.TEXT_INPUT)
     poll = models.ForeignKey(Poll, related_name='questions', on_delete=models.CASCADE)
 
+    TALLIED_TYPES = (QuestionChoice.SINGLE_CHOICE, QuestionChoice.MULTIPLE_CHOICE, QuestionChoice.DROPDOWN_CHOICE)
+
     def __str__(self):
         return self.content
 
+    @property
+    def choice_list(self):
+        return split_choices(self.choices)
+
+    def encode_answer(self, value):
+        """
+        Returns the structured form (selection, number) of an answer: a bitmask of option positions
+        for SC/MC/DC questions and the parsed value for NI questions. Requires prefetched options.
+        """
+        if self.type in self.TALLIED_TYPES:
+            positions = {option.label: option.position for option in self.options.all()}
+            bits = [positions[label] for label in split_choices(value) if label in positions]
+            return (sum(1 << bit for bit in set(bits)) if bits else None), None
+        if self.type == self.QuestionChoice.NUMERIC_INPUT:
+            return None, parse_number(value)
+        return None, None
+
+
+class QuestionOptionManager(models.Manager):
+    def sync(self, questions):
+        """
+        Creates options for new labels in the choices of the given questions. Existing options keep
+        their position (the bit used in Answer.selection); options removed from choices are kept so
+        stored answers still decode.
+        """
+        questions = [q for q in questions if q.type in Question.TALLIED_TYPES]
+        existing = defaultdict(dict)
+        for option in self.filter(question__in=questions):
+            existing[option.question_id][option.label] = option.position
+
+        new_options = []
+        for question in questions:
+            positions = existing[question.id]
+            next_position = max(positions.values(), default=-1) + 1
+            for label in question.choice_list:
+                if label not in positions and next_position < QuestionOption.MAX_OPTIONS:
+                    positions[label] = next_position
+                    new_options.append(QuestionOption(question=question, position=next_position, label=label))
+                    next_position += 1
+        self.bulk_create(new_options)
+
+
+class QuestionOption(models.Model):
+    # pozicija je bit u Answer.selection (BigIntegerField s predznakom - 63 bita)
+    MAX_OPTIONS = 63
+
+    class Meta:
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'position'], name='unique_question_option_position')
+        ]
+
+    objects = QuestionOptionManager()
+
+    question = models.ForeignKey(Question, related_name='options', on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField()
+    label = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.label
+
+
+class SubmittedPollManager(models.Manager):
+    def submit(self, poll, answers_data, questions, user=None):
+        """
+        Saves a submission with all of its answers in one transaction.
+        `questions` maps the answered question ids to already validated questions of the poll.
+        """
+        return self.bulk_submit([(self.model(poll=poll, user=user), answers_data)], questions)[0]
+
+    def bulk_submit(self, submissions, questions):
+        """
+        Saves many submissions with their answers, tallies and poll versions in one transaction.
+        `submissions` is a list of (unsaved SubmittedPoll, answers data) pairs and `questions` maps the answered
+        question ids to questions; answers to other questions are skipped.
+        """
+        submitted_polls = [submitted_poll for submitted_poll, _ in submissions]
+        with transaction.atomic():
+            if connections[router.db_for_write(self.model)].features.can_return_rows_from_bulk_insert:
+                self.bulk_create(submitted_polls)
+            else:
+                # SQLite ne vraca id-eve iz bulk_create, a potrebni su za odgovore
+                for submitted_poll in submitted_polls:
+                    submitted_poll.save(force_insert=True)
+
+            answers = [(submitted_poll, answer) for submitted_poll, answers_data in submissions
+                       for answer in answers_data if answer['question_id'] in questions]
+            Answer.objects.bulk_create([
+                Answer(submitted_poll=submitted_poll, question_id=answer['question_id'], answer=answer.get('answer'),
+                       **Answer.structured(questions[answer['question_id']], answer.get('answer')))
+                for submitted_poll, answer in answers
+            ])
+            counts, numbers = QuestionTally.objects.record(
+                questions, ((answer['question_id'], answer.get('answer')) for _, answer in answers))
+
+            poll_submissions = Counter(submitted_poll.poll_id for submitted_poll in submitted_polls)
+            # ankete se zakljucavaju uvijek istim redom - istovremeni batchevi se ne zakljucaju medusobno
+            for poll_id, count in sorted(poll_submissions.items()):
+                Poll.objects.touch(poll_id, submission_count=count)
+
+            poll_counts, poll_numbers = defaultdict(dict), defaultdict(dict)
+            for (question_id, option), count in counts.items():
+                poll_counts[questions[question_id].poll_id][(question_id, option)] = count
+            for question_id, values in numbers.items():
+                poll_numbers[questions[question_id].poll_id][question_id] = values
+            transaction.on_commit(lambda: [
+                publish_results(poll_id, poll_counts[poll_id], poll_numbers[poll_id], submissions=count)
+                for poll_id, count in poll_submissions.items()])
+        return submitted_polls
+
+    def remove(self, submitted_poll):
+        """
+        Deletes a submission and subtracts its answers from the tallies and numeric summaries of its questions.
+        """
+        with transaction.atomic():
+            # zakljucani redak - istovremeno brisanje istog submissiona ne oduzima odgovore dvaput
+            if not list(self.select_for_update().filter(pk=submitted_poll.pk).values_list('pk', flat=True)):
+                return
+            answers = list(Answer.objects.filter(submitted_poll_id=submitted_poll.pk).values_list('question_id', 'answer'))
+            questions = Question.objects.prefetch_related('options').in_bulk({question_id for question_id, _ in answers})
+            self.filter(pk=submitted_poll.pk).delete()
+            QuestionTally.objects.discard(questions, answers)
+            Poll.objects.touch(submitted_poll.poll_id, submission_count=-1)
+
 
 class SubmittedPoll(models.Model):
-    answered_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['poll', '-answered_at'], name='submitted_poll_answered_idx'),
+        ]
+
+    objects = SubmittedPollManager()
+
+    # default umjesto auto_now_add - submission iz write-behind buffera zadrzava vrijeme prijema
+    answered_at = models.DateTimeField(default=timezone.now, editable=False)
     poll = models.ForeignKey(Poll, related_name='submitted_polls', on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='submitted_polls', on_delete=models.CASCADE, blank=True, null=True)
 
 
+class SubmissionBufferCheckpoint(models.Model):
+    """
+    Last write-behind buffer entry whose submission is saved; updated in the same transaction as the submissions,
+    so a buffer replayed after a crash skips what was already flushed.
+    """
+    buffer = models.CharField(max_length=255, unique=True)
+    flushed_id = models.BigIntegerField(default=0)
+
+
+class SubmissionArchiveManager(models.Manager):
+    def freeze(self, poll_id, batch_size=500):
+        """
+        Moves the submissions of an archived poll with their answers out of the hot tables into compressed
+        SubmissionArchive rows, one row and one transaction per batch. Stops when the poll is restored;
+        returns the number of moved submissions.
+        """
+        moved = 0
+        while True:
+            with transaction.atomic():
+                if not Poll._base_manager.select_for_update().filter(pk=poll_id, archived=True).exists():
+                    return moved
+                submitted_polls = list(SubmittedPoll.objects.filter(poll_id=poll_id).order_by('pk')
+                                       .values_list('pk', 'user_id', 'answered_at')[:batch_size])
+                if not submitted_polls:
+                    return moved
+
+                pks = [pk for pk, _, _ in submitted_polls]
+                answers = defaultdict(list)
+                for pk, submitted_poll_id, *values in (Answer.objects.filter(submitted_poll_id__in=pks).order_by('pk')
+                                                       .values_list('pk', 'submitted_poll_id', 'question_id', 'answer',
+                                                                    'selection', 'number')):
+                    answers[submitted_poll_id].append([pk] + values)
+                rows = [[pk, user_id, answered_at.isoformat(), answers[pk]] for pk, user_id, answered_at in submitted_polls]
+                self.create(poll_id=poll_id, count=len(rows), data=zlib.compress(dumps(rows)))
+
+                Answer.objects.filter(submitted_poll_id__in=pks).delete()
+                SubmittedPoll.objects.filter(pk__in=pks).delete()
+            moved += len(rows)
+
+    def rehydrate(self, poll_id):
+        """
+        Moves the archived submissions of a poll back into SubmittedPoll/Answer with their original ids.
+        Submissions of users deleted in the meantime are dropped, as the user's cascade would have done, and answers
+        to deleted questions are skipped. Returns the number of restored submissions.
+        """
+        questions = set(Question.objects.filter(poll_id=poll_id).values_list('pk', flat=True))
+        restored = dropped = 0
+        for archive in self.filter(poll_id=poll_id).order_by('pk').iterator():
+            rows = loads(zlib.decompress(archive.data))
+            users = set(CustomUser._base_manager.filter(pk__in={row[1] for row in rows if row[1] is not None})
+                        .values_list('pk', flat=True))
+            kept = [row for row in rows if row[1] is None or row[1] in users]
+
+            SubmittedPoll.objects.bulk_create([
+                SubmittedPoll(pk=pk, poll_id=poll_id, user_id=user_id, answered_at=parse_datetime(answered_at))
+                for pk, user_id, answered_at, _ in kept])
+            Answer.objects.bulk_create([
+                Answer(pk=pk, submitted_poll_id=submitted_poll_id, question_id=question_id, answer=answer,
+                       selection=selection, number=number)
+                for submitted_poll_id, _, _, answers in kept
+                for pk, question_id, answer, selection, number in answers if question_id in questions])
+            archive.delete()
+            restored += len(kept)
+            dropped += len(rows) - len(kept)
+
+        if dropped:
+            Poll.objects.increment(poll_id, submission_count=-dropped)
+        return restored
+
+
+class SubmissionArchive(models.Model):
+    """
+    Cold storage of an archived poll's submissions (see the archive_polls command): a zlib-compressed JSON list of
+    [id, user id, answered at, [[answer id, question id, answer, selection, number], ...]] rows.
+    """
+    objects = SubmissionArchiveManager()
+
+    poll = models.ForeignKey(Poll, related_name='submission_archives', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class AnswerManager(models.Manager):
+    def encode_stored(self, questions):
+        """
+        Fills selection/number of stored answers that only have the answer text.
+        Answers are grouped by distinct (question, text), so each group costs one UPDATE.
+        """
+        updated = 0
+        for question in questions.prefetch_related('options'):
+            if question.type not in Question.TALLIED_TYPES and question.type != Question.QuestionChoice.NUMERIC_INPUT:
+                continue
+            pending = self.filter(question=question, selection__isnull=True, number__isnull=True)
+            for value in pending.values_list('answer', flat=True).distinct().order_by().iterator():
+                fields = Answer.structured(question, value)
+                if any(field is not None for field in fields.values()):
+                    updated += pending.filter(answer=value).update(**fields)
+        return updated
+
+
+    def change(self, answer, value):
+        """
+        Changes the text of a stored answer, re-encodes it and moves it between the tallies of its question.
+        """
+        with transaction.atomic():
+            # zakljucan odgovor - istovremene izmjene ne oduzimaju isti stari odgovor dvaput
+            answer = self.select_for_update().get(pk=answer.pk)
+            question = Question.objects.prefetch_related('options').get(pk=answer.question_id)
+            old_value = answer.answer
+            answer.answer = value
+            for field, encoded in Answer.structured(question, value).items():
+                setattr(answer, field, encoded)
+            # novi odgovor se sprema prije oduzimanja, da se uklonjeni minimum/maksimum racuna bez starog
+            answer.save(update_fields=['answer', 'selection', 'number'])
+            QuestionTally.objects.discard({question.id: question}, [(question.id, old_value)])
+            QuestionTally.objects.record({question.id: question}, [(question.id, value)])
+            Poll.objects.touch(question.poll_id)
+        return answer
+
+    def remove(self, answer):
+        with transaction.atomic():
+            if not list(self.select_for_update().filter(pk=answer.pk).values_list('pk', flat=True)):
+                return
+            question = Question.objects.prefetch_related('options').get(pk=answer.question_id)
+            self.filter(pk=answer.pk).delete()
+            QuestionTally.objects.discard({question.id: question}, [(question.id, answer.answer)])
+            Poll.objects.touch(question.poll_id)
+
+
 class Answer(models.Model):
+    class Meta:
+        indexes = [
+            # grupiranje odgovora po pitanju za rebuild_tallies
+            models.Index(fields=['question', 'answer'], name='answer_question_answer_idx'),
+            models.Index(fields=['question', 'selection'], name='answer_question_selection_idx'),
+        ]
+
+    objects = AnswerManager()
+
+    # answer ostaje tekst koji klijenti salju i dobivaju; selection/number su strukturirani oblik za agregacije
     answer = models.CharField(max_length=100, blank=True, null=True)
+    selection = models.BigIntegerField(blank=True, null=True)
+    number = models.FloatField(blank=True, null=True)
     question = models.ForeignKey(Question, related_name='answers', on_delete=models.CASCADE)
     submitted_poll = models.ForeignKey(SubmittedPoll, related_name='answers', on_delete=models.CASCADE)
 
     def __str__(self):
         return self.answer
 
+    @staticmethod
+    def structured(question, value):
+        selection, number = question.encode_answer(value)
+        return {'selection': selection, 'number': number}
+
+class FavoritePollManager(models.Manager):
+    def add(self, user, poll):
+        """
+        Marks the poll as a favorite of the user; returns False when it already was one.
+        """
+        # jedinstveni (user, poll) - INSERT koji ne uspije za postojeci par umjesto provjere pa inserta
+        try:
+            with transaction.atomic():
+                self.lock_polls([poll.pk])
+                self.create(user=user, poll=poll)
+                Poll.objects.increment(poll.pk, favorite_count=1)
+        except IntegrityError:
+            return False
+        return True
+
+    def remove(self, favorite):
+        with transaction.atomic():
+            self.lock_polls([favorite.poll_id])
+            deleted, _ = self.filter(pk=favorite.pk).delete()
+            if deleted:
+                Poll.objects.increment(favorite.poll_id, favorite_count=-1)
+
+    def add_many(self, user, poll_ids):
+        """
+        Marks the polls as favorites of the user; returns the ids of polls that were not favorites before.
+        """
+        with transaction.atomic():
+            # uz zakljucane ankete istovremeni dodavatelji cekaju pa citanje postojecih vidi sve upisane favorite
+            polls = self.lock_polls(poll_ids)
+            existing = set(self.filter(user=user, poll_id__in=poll_ids).values_list('poll_id', flat=True))
+            added = [pk for pk in poll_ids if pk in polls and pk not in existing]
+            self.bulk_create([FavoritePoll(user=user, poll_id=pk) for pk in added])
+            Poll.objects.increment_many(added, favorite_count=1)
+        return set(added)
+
+    def remove_many(self, user, poll_ids):
+        """
+        Removes the polls from the user's favorites; returns the ids of polls that were favorites.
+        """
+        with transaction.atomic():
+            self.lock_polls(poll_ids)
+            # zakljucani retci - istovremeno uklanjanje istog favorita ne smanjuje brojac dvaput
+            removed = list(self.select_for_update().filter(user=user, poll_id__in=poll_ids).values_list('poll_id', flat=True))
+            self.filter(user=user, poll_id__in=removed).delete()
+            Poll.objects.increment_many(removed, favorite_count=-1)
+        return set(removed)
+
+    def lock_polls(self, poll_ids):
+        # favoriti jedne ankete mijenjaju se jedan za drugim; ankete se zakljucavaju uvijek istim redom (pk)
+        return set(Poll._base_manager.select_for_update().filter(pk__in=poll_ids).order_by('pk').values_list('pk', flat=True))
+
+
 class FavoritePoll(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'poll'], name='unique_favorite_poll')
+        ]
+
+    objects = FavoritePollManager()
+
     poll = models.ForeignKey(Poll, related_name='poll', on_delete=models.CASCADE)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='user', on_delete=models.CASCADE, blank=True, null=True)
\ No newline at end of file
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='user', on_delete=models.CASCADE, blank=True, null=True)
+
+
+class QuestionTallyManager(models.Manager):
+    def count_answers(self, questions, answers):
+        """
+        Returns the option counts and the numeric values of answers, as (counts, numbers).
+        `questions` maps question ids to questions, `answers` is an iterable of (question_id, answer) pairs.
+        """
+        counts = Counter()
+        numbers = defaultdict(list)
+        # zbrajaju se samo oznake koje pitanje ima (i one izbacene iz choices) - ostale nisu izbori
+        labels = {}
+
+        for question_id, value in answers:
+            question = questions.get(question_id)
+            if question is None:
+                continue
+            if question.type in Question.TALLIED_TYPES:
+                if question_id not in labels:
+                    labels[question_id] = {option.label for option in question.options.all()}
+                for option in split_choices(value):
+                    if option in labels[question_id]:
+                        counts[(question_id, option)] += 1
+            elif question.type == Question.QuestionChoice.NUMERIC_INPUT:
+                number = parse_number(value)
+                if number is not None:
+                    numbers[question_id].append(number)
+        return counts, numbers
+
+    def record(self, questions, answers):
+        """
+        Adds submitted answers to the tallies of their questions; arguments are those of count_answers.
+        """
+        counts, numbers = self.count_answers(questions, answers)
+
+        # nedostajuci retci se kreiraju jednim upitom, a zatim se povecavaju jednim UPDATE-om po iznosu povecanja
+        self.bulk_create(
+            [QuestionTally(question_id=question_id, option=option) for question_id, option in sorted(counts)],
+            ignore_conflicts=True)
+        self.add_counts(counts)
+
+        if numbers:
+            NumericSummary.objects.record(numbers)
+
+        return counts, numbers
+
+    def discard(self, questions, answers):
+        """
+        Subtracts deleted answers from the tallies of their questions; arguments are those of count_answers.
+        """
+        counts, numbers = self.count_answers(questions, answers)
+        self.add_counts({key: -count for key, count in counts.items()})
+        if numbers:
+            NumericSummary.objects.discard(numbers)
+        return counts, numbers
+
+    def add_counts(self, counts):
+        # retci se prvo zakljucavaju po (pitanje, opcija), a zatim mijenjaju jednim UPDATE-om po iznosu promjene;
+        # UPDATE sam zakljucava retke proizvoljnim redom pa bi se istovremene predaje mogle medusobno zakljucati
+        with transaction.atomic():
+            keys = sorted(counts)
+            for start in range(0, len(keys), 500):
+                list(self.select_for_update().filter(self.condition(keys[start:start + 500]))
+                     .order_by('question_id', 'option').values_list('pk', flat=True))
+
+            keys_by_count = defaultdict(list)
+            for key in keys:
+                keys_by_count[counts[key]].append(key)
+            for count, keys in keys_by_count.items():
+                for start in range(0, len(keys), 500):
+                    self.filter(self.condition(keys[start:start + 500])).update(count=F('count') + count)
+
+    def condition(self, keys):
+        return reduce(or_, (Q(question_id=question_id, option=option) for question_id, option in keys))
+
+    def rebuild(self, polls=None):
+        """
+        Recomputes tallies and numeric summaries from stored answers.
+        """
+        # odgovori ankete u SubmissionArchive nisu u tablici Answer - njihovi zbrojevi ostaju kakvi jesu
+        questions = Question.objects.filter(poll__submission_archives__isnull=True)
+        if polls is not None:
+            questions = questions.filter(poll__in=polls)
+        question_types = dict(questions.values_list('id', 'type'))
+
+        self.filter(question_id__in=question_types.keys()).delete()
+        NumericSummary.objects.filter(question_id__in=question_types.keys()).delete()
+
+        choice_ids = [pk for pk, question_type in question_types.items() if question_type in Question.TALLIED_TYPES]
+        numeric_ids = [pk for pk, question_type in question_types.items() if question_type == Question.QuestionChoice.NUMERIC_INPUT]
+
+        labels = defaultdict(set)
+        for question_id, label in QuestionOption.objects.filter(question_id__in=choice_ids).values_list('question_id', 'label'):
+            labels[question_id].add(label)
+        counts = Counter()
+        grouped = (Answer.objects.filter(question_id__in=choice_ids)
+                   .values_list('question_id', 'answer')
+                   .annotate(count=models.Count('id'))
+                   .order_by())
+        for question_id, value, count in grouped.iterator():
+            for option in split_choices(value):
+                if option in labels[question_id]:
+                    counts[(question_id, option)] += count
+        self.bulk_create(
+            [QuestionTally(question_id=question_id, option=option, count=count)
+             for (question_id, option), count in counts.items()])
+
+        summaries = {}
+        answers = Answer.objects.filter(question_id__in=numeric_ids).values_list('question_id', 'answer')
+        for question_id, value in answers.iterator():
+            number = parse_number(value)
+            if number is None:
+                continue
+            summary = summaries.setdefault(question_id, NumericSummary(question_id=question_id))
+            summary.add(number)
+        for summary in summaries.values():
+            summary.store_sketch()
+        NumericSummary.objects.bulk_create(summaries.values())
+
+
+class QuestionTally(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'option'], name='unique_question_option_tally')
+        ]
+
+    objects = QuestionTallyManager()
+
+    question = models.ForeignKey(Question, related_name='tallies', on_delete=models.CASCADE)
+    option = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+
+class NumericSummaryManager(models.Manager):
+    def record(self, numbers):
+        """
+        Adds values to the summaries of numeric questions; `numbers` maps question ids to lists of values.
+        """
+        # sketch se azurira u Pythonu pa se retci zakljucavaju do kraja transakcije predaje, uvijek istim redom
+        with transaction.atomic():
+            locked = self.select_for_update().filter(question_id__in=numbers).order_by('question_id')
+            summaries = {summary.question_id: summary for summary in locked}
+            missing = numbers.keys() - summaries.keys()
+            if missing:
+                self.bulk_create([NumericSummary(question_id=question_id) for question_id in missing], ignore_conflicts=True)
+                summaries.update({summary.question_id: summary for summary in locked.filter(question_id__in=missing)})
+
+            for question_id, values in numbers.items():
+                summary = summaries[question_id]
+                for value in values:
+                    summary.add(value)
+                summary.store_sketch()
+            self.bulk_update(summaries.values(), ['count', 'total', 'minimum', 'maximum', 'squared_deviations', 'sketch'])
+
+    def discard(self, numbers):
+        """
+        Subtracts values of deleted answers from the summaries of numeric questions; `numbers` is as in record.
+        Call after the answers are deleted - a removed minimum or maximum is recomputed from the remaining answers.
+        """
+        with transaction.atomic():
+            summaries = list(self.select_for_update().filter(question_id__in=numbers).order_by('question_id'))
+            for summary in summaries:
+                values = numbers[summary.question_id]
+                for value in values:
+                    summary.discard(value)
+                if summary.count and (summary.minimum in values or summary.maximum in values):
+                    remaining = Answer.objects.filter(question_id=summary.question_id, number__isnull=False).aggregate(
+                        minimum=models.Min('number'), maximum=models.Max('number'))
+                    summary.minimum, summary.maximum = remaining['minimum'], remaining['maximum']
+                summary.store_sketch()
+            self.bulk_update(summaries, ['count', 'total', 'minimum', 'maximum', 'squared_deviations', 'sketch'])
+
+
+class NumericSummary(models.Model):
+    """
+    Running statistics of a numeric question: count, sum, min, max, the sum of squared deviations
+    (for variance) and a DDSketch for approximate quantiles and histograms. Summaries are mergeable.
+    """
+    QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+    HISTOGRAM_BUCKETS = 10
+
+    objects = NumericSummaryManager()
+
+    question = models.OneToOneField(Question, related_name='numeric_summary', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0)
+    minimum = models.FloatField(blank=True, null=True)
+    maximum = models.FloatField(blank=True, null=True)
+    squared_deviations = models.FloatField(default=0)
+    sketch = models.TextField(blank=True, default='')
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def variance(self):
+        return self.squared_deviations / self.count if self.count else None
+
+    @property
+    def quantile_sketch(self):
+        if not hasattr(self, '_sketch'):
+            self._sketch = DDSketch.from_json(self.sketch)
+        return self._sketch
+
+    def add(self, value):
+        # Welford: odstupanje od stare i nove srednje vrijednosti
+        previous_mean = self.mean or 0
+        self.count += 1
+        self.total += value
+        self.squared_deviations += (value - previous_mean) * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.quantile_sketch.add(value)
+
+    def discard(self, value):
+        # obrnuti Welford korak; minimum i maksimum preracunava NumericSummaryManager.discard
+        if self.count <= 1:
+            self.count, self.total, self.squared_deviations = 0, 0, 0
+            self.minimum = self.maximum = None
+            self._sketch = DDSketch()
+            return
+        previous_mean = self.mean
+        self.count -= 1
+        self.total -= value
+        self.squared_deviations = max(self.squared_deviations - (value - previous_mean) * (value - self.mean), 0)
+        self.quantile_sketch.remove(value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - (self.mean or 0)
+        self.squared_deviations += other.squared_deviations + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.quantile_sketch.merge(other.quantile_sketch)
+
+    def store_sketch(self):
+        if hasattr(self, '_sketch'):
+            self.sketch = self._sketch.to_json()
+
+    def save(self, *args, **kwargs):
+        self.store_sketch()
+        super().save(*args, **kwargs)
+
+    def quantiles(self):
+        values = self.quantile_sketch.quantiles(self.QUANTILES)
+        return {'p{}'.format(int(q * 100)): value for q, value in zip(self.QUANTILES, values)}
+
+    def histogram(self):
+        return self.quantile_sketch.histogram(self.minimum, self.maximum, self.HISTOGRAM_BUCKETS)
@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PollCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        # rezultati pretrage (PollSearchFilter) se redaju po rangu
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-id')
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        # ?ordering= po brojacima nije jedinstven pa se dodaje id kao drugi kljuc
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering += ('-id' if ordering[-1].startswith('-') else 'id',)
+        return ordering
+
+
+class SubmittedPollCursorPagination(PollCursorPagination):
+    ordering = ('-answered_at', '-id')
+
+
+class AnswerCursorPagination(PollCursorPagination):
+    ordering = ('-id',)
@@ -0,0 +1,110 @@
+import json
+
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import encoders
+from rest_framework.utils.json import strict_constant
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# tipovi koje brzi enkoderi ne poznaju (lazy prijevodi, Decimal, QuerySet...) pretvaraju se kao u DRF-u
+encode_default = encoders.JSONEncoder().default
+
+
+def stdlib_dumps(data):
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def stdlib_loads(data):
+    return json.loads(data, parse_constant=strict_constant)
+
+
+if orjson is not None:
+    JSON_LIBRARY = 'orjson'
+    loads = orjson.loads
+
+    def dumps(data):
+        return orjson.dumps(data, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+elif ujson is not None:
+    JSON_LIBRARY = 'ujson'
+    loads = ujson.loads
+
+    def dumps(data):
+        try:
+            return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode()
+        except (TypeError, OverflowError):
+            return stdlib_dumps(data)
+else:
+    JSON_LIBRARY = 'json'
+    loads = stdlib_loads
+    dumps = stdlib_dumps
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    Compact JSON rendered with orjson or ujson when installed, otherwise with the stdlib.
+    Indented output (`; indent=` in Accept, the browsable API) is left to DRF's JSONRenderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # kao JSONRenderer - JSON mora ostati podskup JavaScripta
+        return dumps(data).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(parsers.JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    MessagePack responses for clients that send `Accept: application/msgpack` (requires the msgpack package).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
@@ -0,0 +1,121 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_SECONDS = getattr(settings, 'POLLS_REPLICA_STICKY_SECONDS', 5)
+PIN_CACHE = getattr(settings, 'POLLS_REPLICA_PIN_CACHE', DEFAULT_CACHE_ALIAS)
+PRIMARY_COOKIE = 'polls_primary'
+
+# cacheovi koje ne vide ostali workeri - klijent bez cookieja (token) bi nakon svog upisa citao repliku
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+read_context = contextvars.ContextVar('pollsapp_read_context', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def pin_key(user_id):
+    return 'pollsapp:primary-pin:{}'.format(user_id)
+
+
+class ReadContext:
+    """
+    Where the reads of one safe request go: the replica chosen for the request, or the primary while
+    the requesting user is pinned to it after their own write.
+    """
+    def __init__(self, request, replica):
+        self.request = request
+        self.replica = replica
+        self.user = None
+        self.pinned = PRIMARY_COOKIE in request.COOKIES
+        self.resolving = False
+
+    def alias(self):
+        if self.pinned or self.resolving:
+            return DEFAULT_DB_ALIAS
+
+        # korisnik je poznat tek nakon DRF autentikacije, koja postavlja request.user
+        self.resolving = True
+        try:
+            user = getattr(self.request, 'user', None)
+            if user is not self.user:
+                self.user = user
+                if user is not None and user.is_authenticated:
+                    self.pinned = bool(caches[PIN_CACHE].get(pin_key(user.pk)))
+        finally:
+            self.resolving = False
+        return DEFAULT_DB_ALIAS if self.pinned else self.replica
+
+
+class ReplicaRouter:
+    """
+    Sends reads of safe requests to a replica and everything else to the primary (`default`).
+    Reads outside requests (management commands, background threads) also use the primary.
+    """
+    def db_for_read(self, model, **hints):
+        context = read_context.get()
+        return context.alias() if context is not None else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """
+    Sets up replica reads for GET/HEAD/OPTIONS requests. A successful write pins its user (and, through
+    a cookie, its browser) to the primary for POLLS_REPLICA_STICKY_SECONDS, so they read their own writes.
+    """
+    def __init__(self, get_response):
+        backend = settings.CACHES[PIN_CACHE]['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            raise ImproperlyConfigured(
+                'Replica reads pin users to the primary through the {!r} cache, which uses the per-process {}. '
+                'Set POLLS_REPLICA_PIN_CACHE to a cache shared by all workers (e.g. Redis or Memcached).'
+                .format(PIN_CACHE, backend.rsplit('.', 1)[-1]))
+        self.get_response = get_response
+        self.replicas = replica_aliases()
+
+    def __call__(self, request):
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        context = ReadContext(request, random.choice(self.replicas)) if safe and self.replicas else None
+
+        token = read_context.set(context)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_context.reset(token)
+
+        if context is not None and response.streaming:
+            # export se cita tek dok server salje odgovor
+            response.streaming_content = self.stream(response.streaming_content, context)
+        if not safe and response.status_code < 400:
+            self.pin(request, response)
+        return response
+
+    def stream(self, content, context):
+        read_context.set(context)
+        try:
+            yield from content
+        finally:
+            read_context.set(None)
+
+    def pin(self, request, response):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            caches[PIN_CACHE].set(pin_key(user.pk), True, STICKY_SECONDS)
+        response.set_cookie(PRIMARY_COOKIE, '1', max_age=STICKY_SECONDS)
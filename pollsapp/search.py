@@ -0,0 +1,125 @@
+import re
+
+from django.db import OperationalError, ProgrammingError, connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+
+def search_tokens(terms):
+    return re.findall(r'\w+', ' '.join(terms).lower())
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 table over poll title and description, kept in sync with pollsapp_poll by triggers.
+    """
+    table = 'pollsapp_poll_fts'
+    triggers = {
+        'pollsapp_poll_fts_insert': """
+            CREATE TRIGGER IF NOT EXISTS pollsapp_poll_fts_insert AFTER INSERT ON pollsapp_poll BEGIN
+                INSERT INTO pollsapp_poll_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+            END""",
+        'pollsapp_poll_fts_delete': """
+            CREATE TRIGGER IF NOT EXISTS pollsapp_poll_fts_delete AFTER DELETE ON pollsapp_poll BEGIN
+                INSERT INTO pollsapp_poll_fts(pollsapp_poll_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END""",
+        'pollsapp_poll_fts_update': """
+            CREATE TRIGGER IF NOT EXISTS pollsapp_poll_fts_update AFTER UPDATE OF title, description ON pollsapp_poll BEGIN
+                INSERT INTO pollsapp_poll_fts(pollsapp_poll_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO pollsapp_poll_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+            END""",
+    }
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            names = [self.table] + list(self.triggers)
+            cursor.execute("SELECT name FROM sqlite_master WHERE name IN ({})".format(', '.join(['%s'] * len(names))), names)
+            existing = {row[0] for row in cursor.fetchall()}
+            if existing == set(names):
+                return
+
+            # SQLite migracije koje prepisuju tablicu pollsapp_poll brisu i triggere pa se indeks gradi ponovno
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, description, "
+                "content='pollsapp_poll', content_rowid='id', tokenize='unicode61 remove_diacritics 2')".format(self.table))
+            for sql in self.triggers.values():
+                cursor.execute(sql)
+        self.rebuild()
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(self.table))
+
+    def search(self, queryset, tokens):
+        """
+        Filters the queryset to polls matching every token as a prefix, annotated with `search_rank`.
+        """
+        query = ' '.join('"{}"*'.format(token) for token in tokens)
+        matches = RawSQL("SELECT rowid FROM {0} WHERE {0} MATCH %s".format(self.table), [query])
+        # bm25 je manji za bolje pogotke; rowid uvjet FTS5 rjesava bez prolaza kroz sve pogotke
+        rank = RawSQL('SELECT -bm25({0}, 2.0, 1.0) FROM {0} WHERE {0} MATCH %s AND rowid = "{1}"."id"'.format(
+            self.table, queryset.model._meta.db_table), [query], output_field=FloatField())
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+class PostgresSearchBackend:
+    """
+    GIN expression index over the tsvector of poll title and description; Postgres keeps it in sync.
+    """
+    document = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+    # za rang naslov ima tezinu A, a opis B; stupci su kvalificirani jer upit moze imati i joinove
+    ranked_document = ("setweight(to_tsvector('simple', coalesce(\"pollsapp_poll\".\"title\", '')), 'A') || "
+                       "setweight(to_tsvector('simple', coalesce(\"pollsapp_poll\".\"description\", '')), 'B')")
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX IF NOT EXISTS pollsapp_poll_search_idx ON pollsapp_poll USING GIN ({})".format(self.document))
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("REINDEX INDEX pollsapp_poll_search_idx")
+
+    def search(self, queryset, tokens):
+        """
+        Filters the queryset to polls matching every token as a prefix, annotated with `search_rank`.
+        """
+        query = ' & '.join('{}:*'.format(token) for token in tokens)
+        matches = RawSQL("SELECT id FROM pollsapp_poll WHERE {} @@ to_tsquery('simple', %s)".format(self.document), [query])
+        rank = RawSQL("ts_rank({}, to_tsquery('simple', %s))".format(self.ranked_document), [query],
+                      output_field=FloatField())
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+unavailable = set()
+
+
+def get_search_backend(using='default'):
+    connection = connections[using]
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is None or using in unavailable:
+        return None
+    return backend(connection)
+
+
+def install_search_index(using='default', **kwargs):
+    backend = get_search_backend(using)
+    if backend is None:
+        return
+    try:
+        backend.install()
+    except (OperationalError, ProgrammingError):
+        # npr. SQLite bez FTS5 - pretraga se vraca na icontains iz SearchFilter
+        unavailable.add(using)
@@ -1,7 +1,8 @@
 import collections
+import math
 
 from rest_framework import serializers
-from .models import Poll, Question, Answer, CustomUser, SubmittedPoll, FavoritePoll
+from .models import Poll, Question, QuestionOption, Answer, CustomUser, SubmittedPoll, FavoritePoll, NumericSummary, parse_number, split_choices
 from django.conf import settings
 from rest_auth.models import TokenModel
 from rest_auth.utils import import_callable
@@ -13,6 +14,9 @@ from django.contrib.auth.models import Permission
 logger = logging.getLogger("mylogger")
 logger.info("Whatever to log")
 
+# najveci broj stavki u jednom batch requestu
+BATCH_LIMIT = getattr(settings, 'POLLS_BATCH_LIMIT', 500)
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -52,13 +56,138 @@ class CustomTokenSerializer(serializers.ModelSerializer):
         fields = ('key', 'user')
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+def wants_answer_count(request):
+    return request is not None and request.query_params.get('answer_count', '').lower() in ('1', 'true')
+
+
+def split_param(value):
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+def fieldset_params(request):
+    """
+    Returns the (fields, expand) sets of a read request's ?fields= and ?expand=; fields is None when every field
+    is wanted. Dotted paths (questions.content) reach fields of nested serializers.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None, set()
+    fields = request.query_params.get('fields')
+    expand = split_param(request.query_params.get('expand', ''))
+    if fields is None:
+        return None, expand
+
+    fields = split_param(fields)
+    # prosirena relacija se prikazuje i kad nije navedena u ?fields=, ako je prikazan njen roditelj
+    for path in expand:
+        parent = path.rpartition('.')[0]
+        if not parent or nested_paths(fields, parent) is not None:
+            fields.add(path)
+    return fields, expand
+
+
+def top_level(paths):
+    return {path.split('.', 1)[0] for path in paths}
+
+
+def nested_paths(paths, name):
+    # 'questions.content' -> 'content' za serializer polja questions; samo 'questions' znaci sva polja
+    if paths is None:
+        return None
+    nested = {path.split('.', 1)[1] for path in paths if path.startswith(name + '.')}
+    return nested or None
+
+
+class SparseFieldsMixin:
+    """
+    Renders only the fields listed in ?fields= and replaces the relations listed in ?expand= (see
+    `expandable_fields`) with nested objects. Writes always use all fields.
+    """
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        paths, expand = self.fieldsets()
+
+        for name, build in self.expandable_fields.items():
+            if name in expand:
+                fields[name] = build()
+        if paths is not None:
+            wanted = top_level(paths)
+            fields = collections.OrderedDict((name, field) for name, field in fields.items() if name in wanted)
+
+        for name, field in fields.items():
+            nested = getattr(field, 'child', field)
+            if isinstance(nested, SparseFieldsMixin):
+                nested.sparse = (nested_paths(paths, name), {path.split('.', 1)[1] for path in expand if path.startswith(name + '.')})
+        return fields
+
+    def fieldsets(self):
+        if getattr(self, 'sparse', None) is not None:
+            return self.sparse
+        root = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if root is None:
+            return fieldset_params(self.context.get('request'))
+        return None, set()
+
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username', 'email')
+
+
+class PollSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Poll
+        fields = ('id', 'title', 'description')
+
+
+class QuestionOptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuestionOption
+        fields = ('position', 'label')
+
+
+def validate_choices(choices, existing=()):
+    """
+    Checks that the labels of a choice question fit its options: each label fits QuestionOption.label and the
+    labels together with the `existing` option labels fit the option positions (removed options keep theirs).
+    """
+    labels = split_choices(choices)
+    max_length = QuestionOption._meta.get_field('label').max_length
+    if any(len(label) > max_length for label in labels):
+        raise serializers.ValidationError({'choices': 'Choices can be at most {} characters long.'.format(max_length)})
+    if len(set(existing) | set(labels)) > QuestionOption.MAX_OPTIONS:
+        raise serializers.ValidationError({'choices': 'A question can have at most {} choices, counting the removed ones.'
+                                          .format(QuestionOption.MAX_OPTIONS)})
+
+
+class QuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.ModelField(model_field=Question()._meta.get_field('id'))
+    answer_count = serializers.IntegerField(read_only=True)
+    expandable_fields = {'options': lambda: QuestionOptionSerializer(many=True, read_only=True)}
 
     class Meta:
         model = Question
-        fields = ['id', 'content', 'choices', 'type', 'required', 'answers']
-        read_only_fields = ('answers', 'id',)
+        fields = ['id', 'content', 'choices', 'type', 'required', 'answer_count']
+        read_only_fields = ('answer_count', 'id',)
+
+    def validate(self, data):
+        # parcijalni update pitanja provjerava i polja koja nisu u requestu
+        instance = self.instance if isinstance(self.instance, Question) else None
+        question_type = data.get('type', instance.type if instance else Question.QuestionChoice.TEXT_INPUT)
+        choices = data.get('choices', instance.choices if instance else None)
+        if question_type in Question.TALLIED_TYPES:
+            existing = instance.options.values_list('label', flat=True) if instance else ()
+            validate_choices(choices, existing)
+        return data
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # answer_count je skup (COUNT nad svim odgovorima) pa se vraca samo na zahtjev: ?answer_count=true
+        if not wants_answer_count(self.context.get('request')):
+            fields.pop('answer_count', None)
+        return fields
 
 
 class AnswerSerializer(serializers.ModelSerializer):
@@ -67,31 +196,195 @@ class AnswerSerializer(serializers.ModelSerializer):
         fields = ['id', 'answer', 'question']
         read_only_fields = ('id',)
 
+    def validate(self, data):
+        # odgovor se moze izmijeniti, ali ne i premjestiti na drugo pitanje
+        if self.instance is not None and data.get('question', self.instance.question) != self.instance.question:
+            raise serializers.ValidationError({'question': 'The question of an answer cannot be changed.'})
+        question = data.get('question') or self.instance.question
+        answers = [{'question_id': question.id, 'answer': data.get('answer')}]
+        if non_numeric_answers(answers, {question.id: question}):
+            raise serializers.ValidationError({'answer': 'Answers to question {} must be numbers.'.format(question.id)})
+        if unknown_choice_answers(answers, {question.id: question}):
+            raise serializers.ValidationError(
+                {'answer': 'Answers to question {} must be among its choices.'.format(question.id)})
+        return data
+
 
-class PollSerializer(serializers.ModelSerializer):
+class PollSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.email')
     questions = QuestionSerializer(many=True)
+    expandable_fields = {'user': lambda: UserSummarySerializer(read_only=True)}
+
+    class Meta:
+        model = Poll
+        fields = ['id', 'title', 'description', 'archived', 'premium', 'archived_at', 'created_at', 'questions', 'user','isFavorite',
+                  'favorite_count', 'submission_count', 'question_count']
+        read_only_fields = ('id', 'created_at', 'archived_at', 'user', 'favorite_count', 'submission_count', 'question_count')
+
+    def validate(self, data):
+        # postojeca pitanja ankete - novi izbori moraju stati u preostale pozicije opcija
+        if not isinstance(self.instance, Poll) or 'questions' not in data:
+            return data
+        existing = collections.defaultdict(set)
+        options = QuestionOption.objects.filter(question__poll=self.instance).values_list('question_id', 'label')
+        for question_id, label in options:
+            existing[question_id].add(label)
+        for question in data['questions']:
+            if question.get('id') in existing and question.get('type') in Question.TALLIED_TYPES:
+                try:
+                    validate_choices(question.get('choices'), existing[question['id']])
+                except serializers.ValidationError as error:
+                    raise serializers.ValidationError({'questions': error.detail})
+        return data
+
+class QuestionResultsSerializer(serializers.ModelSerializer):
+    results = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Question
+        fields = ['id', 'content', 'type', 'results']
+
+    def get_results(self, question):
+        if question.type in Question.TALLIED_TYPES:
+            tallies = collections.OrderedDict((option, 0) for option in question.choice_list)
+            for tally in question.tallies.all():
+                tallies[tally.option] = tally.count
+            return tallies
+
+        if question.type == Question.QuestionChoice.NUMERIC_INPUT:
+            summary = getattr(question, 'numeric_summary', None) or NumericSummary()
+            variance = summary.variance
+            return {'count': summary.count, 'sum': summary.total, 'min': summary.minimum,
+                    'max': summary.maximum, 'mean': summary.mean, 'variance': variance,
+                    'std': math.sqrt(variance) if variance is not None else None,
+                    'quantiles': summary.quantiles(), 'histogram': summary.histogram()}
+
+        return None
+
+
+class PollResultsSerializer(serializers.ModelSerializer):
+    questions = QuestionResultsSerializer(many=True)
 
     class Meta:
         model = Poll
-        fields = ['id', 'title', 'description', 'archived', 'premium', 'archived_at', 'created_at', 'questions', 'user','isFavorite']
-        read_only_fields = ('id', 'created_at', 'archived_at', 'user')
+        fields = ['id', 'title', 'questions']
+
+
+class SubmittedAnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # pitanja se provjeravaju jednim upitom u SubmittedPollSerializer.validate umjesto po odgovoru
+    question = serializers.IntegerField(source='question_id')
+
+    class Meta:
+        model = Answer
+        fields = ['id', 'answer', 'question']
+        read_only_fields = ('id',)
+
+
+def non_numeric_answers(answers, questions):
+    """
+    Returns the ids of numeric input questions whose answers are not finite numbers.
+    """
+    return sorted({answer['question_id'] for answer in answers
+                   if answer['question_id'] in questions
+                   and questions[answer['question_id']].type == Question.QuestionChoice.NUMERIC_INPUT
+                   and answer.get('answer') not in (None, '') and parse_number(answer['answer']) is None})
+
 
-class SubmittedPollSerializer(serializers.ModelSerializer):
+def unknown_choice_answers(answers, questions):
+    """
+    Returns the ids of choice questions whose answers contain labels that are not among their choices.
+    """
+    return sorted({answer['question_id'] for answer in answers
+                   if answer['question_id'] in questions
+                   and questions[answer['question_id']].type in Question.TALLIED_TYPES
+                   and not set(split_choices(answer.get('answer'))) <= set(questions[answer['question_id']].choice_list)})
+
+
+class SubmittedPollSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.email')
-    answers = AnswerSerializer(many=True)
+    answers = SubmittedAnswerSerializer(many=True)
+    expandable_fields = {
+        'poll': lambda: PollSummarySerializer(read_only=True),
+        'user': lambda: UserSummarySerializer(read_only=True),
+    }
 
     class Meta:
         model = SubmittedPoll
         fields = ['id', 'answered_at', 'poll', 'answers', 'user']
         read_only_fields = ('id', 'answered_at', 'user',)
 
+    def validate(self, data):
+        # parcijalni update bez odgovora nema sto provjeriti; anketa se uzima iz postojeceg submissiona
+        if 'answers' not in data:
+            return data
+        poll = data['poll'] if 'poll' in data else self.instance.poll
+
+        question_ids = {answer['question_id'] for answer in data['answers']}
+        questions = Question.objects.filter(poll=poll).prefetch_related('options').in_bulk(question_ids)
+
+        unknown = sorted(question_ids - questions.keys())
+        if unknown:
+            raise serializers.ValidationError(
+                {'answers': 'Questions {} do not belong to poll {}.'.format(unknown, poll.id)})
+        non_numeric = non_numeric_answers(data['answers'], questions)
+        if non_numeric:
+            raise serializers.ValidationError({'answers': 'Answers to questions {} must be numbers.'.format(non_numeric)})
+        unknown_choices = unknown_choice_answers(data['answers'], questions)
+        if unknown_choices:
+            raise serializers.ValidationError(
+                {'answers': 'Answers to questions {} must be among their choices.'.format(unknown_choices)})
+
+        self.questions = questions
+        return data
+
     def create(self, validated_data):
-        answers_data = validated_data.pop('answers')
-        submitted_poll = SubmittedPoll.objects.create(**validated_data)
-        for answer in answers_data:
-            Answer.objects.create(submitted_poll=submitted_poll, **answer)
-        return submitted_poll
+        return SubmittedPoll.objects.submit(
+            validated_data['poll'], validated_data['answers'], self.questions, user=validated_data.get('user'))
+
+class SubmissionBatchItemSerializer(serializers.Serializer):
+    poll = serializers.IntegerField()
+    answers = SubmittedAnswerSerializer(many=True)
+
+
+def validate_submission_batch(items):
+    """
+    Validates the submissions of a batch together, with one query for their polls and one for their questions.
+    Returns (valid, errors, questions): `valid` lists (index, validated data) pairs, `errors` maps item indexes to
+    error details and `questions` maps the answered question ids to questions.
+    """
+    valid, errors = [], {}
+    for index, item in enumerate(items):
+        serializer = SubmissionBatchItemSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            errors[index] = serializer.errors
+
+    polls = set(Poll.objects.filter(pk__in={data['poll'] for _, data in valid}).values_list('pk', flat=True))
+    question_ids = {answer['question_id'] for _, data in valid for answer in data['answers']}
+    questions = Question.objects.filter(poll_id__in=polls).prefetch_related('options').in_bulk(question_ids)
+
+    checked = []
+    for index, data in valid:
+        if data['poll'] not in polls:
+            errors[index] = {'poll': ['Invalid pk "{}" - object does not exist.'.format(data['poll'])]}
+            continue
+        unknown = sorted({answer['question_id'] for answer in data['answers']
+                          if answer['question_id'] not in questions or questions[answer['question_id']].poll_id != data['poll']})
+        if unknown:
+            errors[index] = {'answers': 'Questions {} do not belong to poll {}.'.format(unknown, data['poll'])}
+            continue
+        non_numeric = non_numeric_answers(data['answers'], questions)
+        if non_numeric:
+            errors[index] = {'answers': 'Answers to questions {} must be numbers.'.format(non_numeric)}
+            continue
+        unknown_choices = unknown_choice_answers(data['answers'], questions)
+        if unknown_choices:
+            errors[index] = {'answers': 'Answers to questions {} must be among their choices.'.format(unknown_choices)}
+            continue
+        checked.append((index, data))
+    return checked, errors, questions
+
 
 class FavoritePollSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.email')
@@ -100,4 +393,17 @@ class FavoritePollSerializer(serializers.ModelSerializer):
     class Meta:
         model = FavoritePoll
         fields = ['id', 'poll', 'user']
-        read_only_fields = ('id',)        
+        read_only_fields = ('id',)
+
+
+class FavoritePollBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=BATCH_LIMIT)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=BATCH_LIMIT)
+
+    def validate(self, data):
+        both = sorted(set(data['add']) & set(data['remove']))
+        if both:
+            raise serializers.ValidationError('Polls {} cannot be both added and removed.'.format(both))
+        # ponovljeni id-evi se obraduju jednom
+        return {'add': list(dict.fromkeys(data['add'])), 'remove': list(dict.fromkeys(data['remove']))}
+
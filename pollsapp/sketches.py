@@ -0,0 +1,112 @@
+import json
+import math
+from collections import Counter
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch with relative accuracy guarantees (DDSketch, Masson et al. 2019).
+    Values are counted in logarithmic bins, so any quantile is returned within `relative_accuracy`
+    of the true value and two sketches with the same accuracy merge by adding their bins.
+    """
+    def __init__(self, relative_accuracy=0.01, positive=None, negative=None, zero=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = Counter(positive or {})
+        self.negative = Counter(negative or {})
+        self.zero = zero
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero
+
+    def key(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > 0:
+            self.positive[self.key(value)] += count
+        elif value < 0:
+            self.negative[self.key(-value)] += count
+        else:
+            self.zero += count
+
+    def remove(self, value, count=1):
+        # vrijednost koja nije dodana ne mijenja sketch
+        if value > 0:
+            bins, key = self.positive, self.key(value)
+        elif value < 0:
+            bins, key = self.negative, self.key(-value)
+        else:
+            self.zero = max(self.zero - count, 0)
+            return
+        if bins[key] > count:
+            bins[key] -= count
+        else:
+            del bins[key]
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged')
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zero += other.zero
+
+    def bins(self):
+        """
+        Yields (representative value, count) in ascending value order.
+        """
+        for key in sorted(self.negative, reverse=True):
+            yield -self.value(key), self.negative[key]
+        if self.zero:
+            yield 0.0, self.zero
+        for key in sorted(self.positive):
+            yield self.value(key), self.positive[key]
+
+    def quantiles(self, quantiles):
+        count = self.count
+        if not count:
+            return [None for _ in quantiles]
+
+        ranks = sorted((q * (count - 1), i) for i, q in enumerate(quantiles))
+        results = [None] * len(quantiles)
+        seen = 0
+        bins = self.bins()
+        value, bin_count = next(bins)
+        for rank, i in ranks:
+            while seen + bin_count <= rank:
+                seen += bin_count
+                value, bin_count = next(bins)
+            results[i] = value
+        return results
+
+    def histogram(self, minimum, maximum, buckets):
+        """
+        Approximate equal-width histogram between minimum and maximum.
+        """
+        if minimum is None or maximum is None:
+            return []
+        width = (maximum - minimum) / buckets or 1
+        counts = [0] * buckets
+        for value, count in self.bins():
+            index = min(max(int((value - minimum) / width), 0), buckets - 1)
+            counts[index] += count
+        return [{'from': minimum + i * width, 'to': minimum + (i + 1) * width, 'count': count}
+                for i, count in enumerate(counts)]
+
+    def to_json(self):
+        return json.dumps({'a': self.relative_accuracy, 'p': self.positive, 'n': self.negative, 'z': self.zero})
+
+    @classmethod
+    def from_json(cls, value, relative_accuracy=0.01):
+        if not value:
+            return cls(relative_accuracy)
+        data = json.loads(value)
+        return cls(data['a'],
+                   {int(key): count for key, count in data['p'].items()},
+                   {int(key): count for key, count in data['n'].items()},
+                   data['z'])
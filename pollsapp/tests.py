@@ -1,3 +1,1054 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+from importlib.util import find_spec
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from polls.asgi import application
+
+from . import buffer, export, routers
+from .analytics import columns_cache
+from .authentication import permission_cache, token_cache
+from .cache import get_polls
+from .middleware import metrics
+from .models import (Answer, CustomUser, FavoritePoll, NumericSummary, Poll, QuestionOption, QuestionTally,
+                     SubmissionArchive, SubmissionBufferCheckpoint, SubmittedPoll)
+
+
+def question(content, type='SC', choices='a,b'):
+    return {'id': 0, 'content': content, 'type': type, 'choices': choices, 'required': False}
+
+
+class APITestMixin:
+    def setUp(self):
+        # id-evi se nakon rollbacka testa ponavljaju pa cacheovi ne smiju zadrzati stare ankete
+        cache.clear()
+        token_cache.clear()
+        permission_cache.clear()
+        self.user = CustomUser.objects.create_user('user', 'user@example.com', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def create_poll(self, *questions):
+        response = self.client.post('/api/v1/polls/', {'title': 'Poll', 'questions': list(questions)}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        poll = Poll.objects.get(pk=response.json()['id'])
+        return poll, list(poll.questions.order_by('pk'))
+
+    def submit(self, poll, answers):
+        return self.client.post('/api/v1/submitted-polls/', {
+            'poll': poll.pk, 'answers': [{'question': q.pk, 'answer': answer} for q, answer in answers],
+        }, format='json')
+
+
+class APITestCase(APITestMixin, TestCase):
+    pass
+
+
+class APITransactionTestCase(APITestMixin, TransactionTestCase):
+    # on_commit callbacki (invalidacija cachea) izvrsavaju se samo izvan TestCase transakcije
+    pass
+
+
+class SubmissionBufferTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'submissions.sqlite3')
+        self.settings = override_settings(POLLS_SUBMISSION_BUFFER=self.path, POLLS_SUBMISSION_BUFFER_NAME='test',
+                                          POLLS_SUBMISSION_BUFFER_LIMIT=3)
+        self.settings.enable()
+        buffer._buffer = None
+        self.poll, self.questions = self.create_poll(question('Color'))
+
+    def tearDown(self):
+        buffer._buffer = None
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def submit_color(self, color='a'):
+        return self.submit(self.poll, [(self.questions[0], color)])
+
+    def test_submissions_are_saved_by_flush(self):
+        for _ in range(2):
+            self.assertEqual(self.submit_color().status_code, 202)
+        self.assertFalse(SubmittedPoll.objects.exists())
+
+        self.assertEqual(buffer.get_buffer().drain(), 2)
+        self.assertEqual(SubmittedPoll.objects.count(), 2)
+        self.assertEqual(Answer.objects.count(), 2)
+        self.assertEqual(Poll.objects.get(pk=self.poll.pk).submission_count, 2)
+        self.assertEqual(QuestionTally.objects.get(option='a').count, 2)
+        self.assertEqual(buffer.get_buffer().stats()['pending'], 0)
+
+    def test_full_buffer_returns_503(self):
+        for _ in range(3):
+            self.assertEqual(self.submit_color().status_code, 202)
+
+        response = self.submit_color()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+        buffer.get_buffer().drain()
+        self.assertEqual(self.submit_color().status_code, 202)
+
+    def test_entries_left_after_a_crash_are_not_saved_twice(self):
+        self.submit_color()
+        self.submit_color()
+        submissions = buffer.get_buffer()
+        rows = submissions.connection().execute('SELECT * FROM submissions').fetchall()
+        submissions.drain()
+
+        # proces je pao nakon commita, prije brisanja unosa iz buffera
+        submissions.connection().executemany('INSERT INTO submissions VALUES (?, ?, ?, ?, ?)', rows)
+        self.submit_color('b')
+        self.assertEqual(submissions.drain(), 1)
+
+        self.assertEqual(SubmittedPoll.objects.count(), 3)
+        self.assertEqual(dict(QuestionTally.objects.values_list('option', 'count')), {'a': 2, 'b': 1})
+        self.assertEqual(submissions.stats()['pending'], 0)
+
+    def test_recreated_buffer_is_replayed_from_the_start(self):
+        self.submit_color()
+        self.submit_color()
+        buffer.get_buffer().drain()
+        self.assertEqual(SubmissionBufferCheckpoint.objects.get(buffer='test').flushed_id, 2)
+
+        buffer._buffer = None
+        os.remove(self.path)
+        self.submit_color('b')
+        self.assertEqual(buffer.get_buffer().drain(), 1)
+
+        self.assertEqual(dict(QuestionTally.objects.values_list('option', 'count')), {'a': 2, 'b': 1})
+        self.assertEqual(SubmissionBufferCheckpoint.objects.get(buffer='test').flushed_id, 1)
+
+
+class AuthenticationCacheTests(APITestCase):
+    def get_archived(self):
+        return self.client.get('/api/v1/polls/archived/').status_code
+
+    def test_token_delete_logs_out(self):
+        self.assertEqual(self.client.get('/api/v1/polls/').status_code, 200)
+        self.assertEqual(self.client.post('/api/v1/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/v1/polls/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/v1/polls/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/polls/').status_code, 401)
+
+    def test_password_change_drops_cached_user(self):
+        self.client.get('/api/v1/polls/')
+        self.assertIn(self.token.key, token_cache.entries)
+        response = self.client.post('/api/v1/auth/password/change/', {
+            'new_password1': 'Xy12345!!ab', 'new_password2': 'Xy12345!!ab'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.token.key, token_cache.entries)
+
+    def test_changes_reach_entries_cached_by_other_workers(self):
+        permission = Permission.objects.get(codename='archived_polls_administration')
+        self.user.user_permissions.add(permission)
+        self.assertEqual(self.get_archived(), 200)
+        # kopije lokalnih cacheova predstavljaju workera koji nije obradio promjene
+        tokens, permissions = dict(token_cache.entries), dict(permission_cache.entries)
+
+        self.user.user_permissions.remove(permission)
+        permission_cache.entries.update(permissions)
+        self.assertEqual(self.get_archived(), 403)
+
+        self.assertEqual(self.client.post('/api/v1/auth/logout/').status_code, 200)
+        token_cache.entries.update(tokens)
+        self.assertEqual(self.client.get('/api/v1/polls/').status_code, 401)
+
+    def test_permission_changes_apply_immediately(self):
+        permission = Permission.objects.get(codename='archived_polls_administration')
+        self.assertEqual(self.get_archived(), 403)
+
+        self.user.user_permissions.add(permission)
+        self.assertEqual(self.get_archived(), 200)
+        self.user.user_permissions.remove(permission)
+        self.assertEqual(self.get_archived(), 403)
+
+        group = Group.objects.create(name='administrators')
+        self.user.groups.add(group)
+        group.permissions.add(permission)
+        self.assertEqual(self.get_archived(), 200)
+        group.permissions.clear()
+        self.assertEqual(self.get_archived(), 403)
+
+
+class ArchiveLifecycleTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.user_permissions.add(Permission.objects.get(codename='archived_polls_administration'))
+        self.poll, self.questions = self.create_poll(question('Color'), question('Age', 'NI', ''))
+        for color, age in (('a', '20'), ('b', '30'), ('a', '')):
+            self.submit(self.poll, [(self.questions[0], color), (self.questions[1], age)])
+
+    def archive(self, days_ago):
+        self.assertEqual(self.client.post('/api/v1/polls/{}/archive/'.format(self.poll.pk)).status_code, 200)
+        Poll._base_manager.filter(pk=self.poll.pk).update(archived_at=timezone.now() - datetime.timedelta(days=days_ago))
+
+    def answers(self):
+        return sorted(Answer.objects.values_list('pk', 'submitted_poll_id', 'question_id', 'answer', 'selection', 'number'))
+
+    def test_freeze_and_restore_round_trip(self):
+        submissions = sorted(SubmittedPoll.objects.values_list('pk', 'user_id', 'answered_at'))
+        answers = self.answers()
+        results = self.client.get('/api/v1/polls/{}/results/'.format(self.poll.pk)).json()
+        self.archive(days_ago=40)
+
+        call_command('archive_polls', batch_size=2, stdout=io.StringIO())
+        self.assertFalse(SubmittedPoll.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(list(SubmissionArchive.objects.values_list('count', flat=True)), [2, 1])
+        self.assertEqual(Poll.objects.reconcile_counters([self.poll.pk]), 0)
+
+        response = self.client.post('/api/v1/polls/{}/restore/'.format(self.poll.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SubmissionArchive.objects.exists())
+        self.assertEqual(sorted(SubmittedPoll.objects.values_list('pk', 'user_id', 'answered_at')), submissions)
+        self.assertEqual(self.answers(), answers)
+        self.assertEqual(self.client.get('/api/v1/polls/{}/results/'.format(self.poll.pk)).json(), results)
+
+    def test_recently_archived_polls_stay_hot(self):
+        self.archive(days_ago=1)
+        call_command('archive_polls', stdout=io.StringIO())
+        self.assertEqual(SubmittedPoll.objects.count(), 3)
+        self.assertFalse(SubmissionArchive.objects.exists())
+
+    def test_expired_polls_are_purged(self):
+        self.archive(days_ago=400)
+        call_command('archive_polls', batch_size=2, stdout=io.StringIO())
+        self.assertFalse(Poll._base_manager.filter(pk=self.poll.pk).exists())
+        self.assertFalse(SubmittedPoll.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+        self.assertFalse(SubmissionArchive.objects.exists())
+
+    def test_delete_action_purges_archived_poll(self):
+        self.archive(days_ago=40)
+        call_command('archive_polls', stdout=io.StringIO())
+        response = self.client.delete('/api/v1/polls/{}/delete/'.format(self.poll.pk))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Poll._base_manager.exists())
+        self.assertFalse(SubmissionArchive.objects.exists())
+        self.assertFalse(QuestionTally.objects.exists())
+
+
+class PollSearchTests(APITestCase):
+    def titles(self, url):
+        titles = []
+        while url:
+            page = self.client.get(url).json()
+            titles += [poll['title'] for poll in page['results']]
+            url = page['next']
+        return titles
+
+    def test_matches_are_not_limited_before_filtering(self):
+        Poll._base_manager.bulk_create([Poll(title='coffee {}'.format(i), user=self.user, archived=True)
+                                        for i in range(600)])
+        Poll._base_manager.bulk_create([Poll(title='coffee {}'.format(i), user=self.user) for i in range(5)])
+        titles = self.titles('/api/v1/polls/?search=coffee&page_size=2')
+        self.assertEqual(sorted(titles), ['coffee {}'.format(i) for i in range(5)])
+
+    def test_prefix_matching_and_title_ranking(self):
+        Poll._base_manager.create(title='Weekend plans', description='coffee or tea', user=self.user)
+        Poll._base_manager.create(title='Coffee machines', description='which one', user=self.user)
+        Poll._base_manager.create(title='Lunch', description='', user=self.user)
+        self.assertEqual(self.titles('/api/v1/polls/?search=coff'), ['Coffee machines', 'Weekend plans'])
+        self.assertEqual(self.titles('/api/v1/polls/?search=coffee machine'), ['Coffee machines'])
+        self.assertEqual(self.titles('/api/v1/polls/?search=nothing'), [])
+
+
+class QuestionTallyTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, self.questions = self.create_poll(question('Color'), question('Food', 'MC', 'x,y,z'))
+
+    def results(self):
+        response = self.client.get('/api/v1/polls/{}/results/'.format(self.poll.pk))
+        return {question['content']: question['results'] for question in response.json()['questions']}
+
+    def test_results_count_submitted_choices(self):
+        color, food = self.questions
+        self.assertEqual(self.submit(self.poll, [(color, 'a'), (food, 'x,z')]).status_code, 201)
+        self.assertEqual(self.submit(self.poll, [(color, 'a'), (food, 'z')]).status_code, 201)
+        self.assertEqual(self.results(), {'Color': {'a': 2, 'b': 0}, 'Food': {'x': 1, 'y': 0, 'z': 2}})
+
+        QuestionTally.objects.all().delete()
+        QuestionTally.objects.rebuild()
+        self.assertEqual(self.results(), {'Color': {'a': 2, 'b': 0}, 'Food': {'x': 1, 'y': 0, 'z': 2}})
+
+    def test_unknown_labels_are_rejected(self):
+        color, food = self.questions
+        response = self.submit(self.poll, [(color, 'a'), (food, 'x,bogus')])
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/v1/submitted-polls/batch/', [
+            {'poll': self.poll.pk, 'answers': [{'question': color.pk, 'answer': 'c'}]},
+            {'poll': self.poll.pk, 'answers': [{'question': color.pk, 'answer': 'b'}]},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [400, 201])
+        self.assertEqual(self.results()['Color'], {'a': 0, 'b': 1})
+
+    def test_rebuild_skips_labels_that_are_not_options(self):
+        color, _ = self.questions
+        self.submit(self.poll, [(color, 'a')])
+        Answer.objects.update(answer='a,bogus')
+        QuestionTally.objects.rebuild()
+        self.assertEqual(dict(QuestionTally.objects.values_list('option', 'count')), {'a': 1})
+
+    def test_deleted_submission_is_subtracted(self):
+        self.poll, self.questions = self.create_poll(question('Color'), question('Food', 'MC', 'x,y,z'),
+                                                     question('Age', 'NI', ''))
+        color, food, age = self.questions
+        for answers in ([(color, 'a'), (food, 'x,y'), (age, '20')], [(color, 'b'), (food, 'y'), (age, '30')],
+                        [(color, 'a'), (age, '40')]):
+            self.assertEqual(self.submit(self.poll, answers).status_code, 201)
+        last = SubmittedPoll.objects.latest('pk')
+
+        response = self.client.delete('/api/v1/submitted-polls/{}/'.format(last.pk))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.delete('/api/v1/submitted-polls/{}/'.format(last.pk)).status_code, 404)
+        results = self.results()
+        self.assertEqual(results['Color'], {'a': 1, 'b': 1})
+        self.assertEqual(results['Food'], {'x': 1, 'y': 2, 'z': 0})
+        self.assertEqual((results['Age']['count'], results['Age']['sum'], results['Age']['max']), (2, 50, 30))
+        self.assertAlmostEqual(results['Age']['variance'], 25)
+        self.assertEqual(Poll.objects.get(pk=self.poll.pk).submission_count, 2)
+
+        for submitted_poll in SubmittedPoll.objects.all():
+            self.client.delete('/api/v1/submitted-polls/{}/'.format(submitted_poll.pk))
+        results = self.results()
+        self.assertEqual(results['Color'], {'a': 0, 'b': 0})
+        self.assertEqual((results['Age']['count'], results['Age']['min'], results['Age']['quantiles']['p50']), (0, None, None))
+
+    def test_edited_answers_move_between_tallies(self):
+        self.poll, self.questions = self.create_poll(question('Color'), question('Age', 'NI', ''))
+        color, age = self.questions
+        self.submit(self.poll, [(color, 'a'), (age, '20')])
+        self.submit(self.poll, [(color, 'a'), (age, '30')])
+        latest = SubmittedPoll.objects.latest('pk')
+        color_answer, age_answer = Answer.objects.filter(submitted_poll=latest).order_by('question')
+
+        response = self.client.patch('/api/v1/answers/{}/'.format(color_answer.pk), {'answer': 'b'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.client.patch('/api/v1/answers/{}/'.format(color_answer.pk), {'answer': 'c'},
+                                           format='json').status_code, 400)
+        self.assertEqual(self.client.patch('/api/v1/answers/{}/'.format(age_answer.pk), {'answer': 'old'},
+                                           format='json').status_code, 400)
+        self.assertEqual(self.client.patch('/api/v1/answers/{}/'.format(age_answer.pk), {'answer': '10'},
+                                           format='json').status_code, 200)
+        self.assertEqual(Answer.objects.get(pk=color_answer.pk).selection, 0b10)
+        self.assertEqual(Answer.objects.get(pk=age_answer.pk).number, 10)
+
+        results = self.results()
+        self.assertEqual(results['Color'], {'a': 1, 'b': 1})
+        self.assertEqual((results['Age']['count'], results['Age']['sum'], results['Age']['min'], results['Age']['max']),
+                         (2, 30, 10, 20))
+
+        self.assertEqual(self.client.delete('/api/v1/answers/{}/'.format(color_answer.pk)).status_code, 204)
+        self.assertEqual(self.results()['Color'], {'a': 1, 'b': 0})
+
+
+class QuestionChoicesTests(APITestCase):
+    def test_long_labels_are_rejected(self):
+        response = self.client.post('/api/v1/polls/', {'title': 'Poll', 'questions': [
+            question('Color', choices='a,' + 'x' * 150)]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_removed_choices_keep_their_positions(self):
+        poll, (color,) = self.create_poll(question('Color', choices=','.join(str(i) for i in range(60))))
+        url = '/api/v1/questions/{}/'.format(color.pk)
+        self.assertEqual(self.client.patch(url, {'choices': 'x,y,z'}, format='json').status_code, 200)
+        self.assertEqual(self.client.patch(url, {'choices': 'x,y,z,w'}, format='json').status_code, 400)
+        self.assertEqual(QuestionOption.objects.filter(question=color).count(), QuestionOption.MAX_OPTIONS)
+
+        response = self.client.put('/api/v1/polls/{}/'.format(poll.pk), {'title': 'Poll', 'questions': [
+            dict(question('Color', choices='w'), id=color.pk)]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('questions', response.json())
+
+    def test_stored_answers_are_encoded(self):
+        poll, (food, age, text) = self.create_poll(question('Food', 'MC', 'x,y,z'), question('Age', 'NI', ''),
+                                                   question('Note', 'TI', ''))
+        self.submit(poll, [(food, 'x,z'), (age, '4.5'), (text, 'hi')])
+        encoded = list(Answer.objects.order_by('question').values_list('selection', 'number'))
+        self.assertEqual(encoded, [(0b101, None), (None, 4.5), (None, None)])
+
+        Answer.objects.update(selection=None, number=None)
+        call_command('encode_answers', stdout=io.StringIO())
+        self.assertEqual(list(Answer.objects.order_by('question').values_list('selection', 'number')), encoded)
+
+
+class PollAnalyticsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        columns_cache.clear()
+        self.poll, self.questions = self.create_poll(question('Color'), question('Food', 'MC', 'x,y'),
+                                                     question('Age', 'NI', ''))
+        for answers in (('a', 'x', '20'), ('a', 'x,y', '30'), ('b', 'y', '40'), ('b', '', '')):
+            self.submit(self.poll, list(zip(self.questions, answers)))
+
+    def analytics(self, question_id, **params):
+        params['question'] = question_id
+        return self.client.get('/api/v1/polls/{}/analytics/'.format(self.poll.pk), params)
+
+    def test_distribution_with_filters(self):
+        color, food, age = self.questions
+        data = self.analytics(food.pk).json()
+        self.assertEqual((data['submissions'], data['matched'], data['results']['respondents']), (4, 4, 3))
+        self.assertEqual([option['count'] for option in data['results']['options']], [2, 2])
+
+        data = self.analytics(age.pk, where='{}:0'.format(color.pk)).json()
+        self.assertEqual((data['matched'], data['results']['count'], data['results']['mean']), (2, 2, 25))
+
+        data = self.analytics(color.pk, where='{}:35..'.format(age.pk)).json()
+        self.assertEqual([option['count'] for option in data['results']['options']], [0, 1])
+
+    def test_crosstab(self):
+        color, food, _ = self.questions
+        data = self.analytics(food.pk, by=color.pk).json()
+        self.assertEqual((data['crosstab']['rows'], data['crosstab']['columns']), (['x', 'y'], ['a', 'b']))
+        self.assertEqual(data['crosstab']['counts'], [[2, 0], [1, 1]])
+
+    def test_invalid_conditions(self):
+        color, _, age = self.questions
+        for where in ('{}:100', '{}:-1', '{}:2', '{}:1..2', 'x:1'):
+            self.assertEqual(self.analytics(age.pk, where=where.format(color.pk)).status_code, 400, where)
+        self.assertEqual(self.analytics(age.pk, where='{}:1'.format(age.pk)).status_code, 400)
+        self.assertEqual(self.analytics(color.pk, by=age.pk).status_code, 400)
+
+
+class FavoritePollBatchTests(APITestCase):
+    def batch(self, **data):
+        response = self.client.post('/api/v1/favorite-polls/batch/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [result['status'] for result in response.json()['results']]
+
+    def favorite_count(self, poll):
+        return Poll.objects.get(pk=poll.pk).favorite_count
+
+    def test_batch_counts_only_added_favorites(self):
+        first, _ = self.create_poll(question('Color'))
+        second, _ = self.create_poll(question('Color'))
+        self.assertEqual(self.client.post('/api/v1/favorite-polls/', {'poll': first.pk}).status_code, 201)
+
+        self.assertEqual(self.batch(add=[first.pk, second.pk, second.pk, 0]), ['unchanged', 'added', 'not_found'])
+        self.assertEqual((self.favorite_count(first), self.favorite_count(second)), (1, 1))
+
+        self.assertEqual(self.batch(remove=[first.pk, first.pk, 0]), ['removed', 'unchanged'])
+        self.assertEqual((self.favorite_count(first), self.favorite_count(second)), (0, 1))
+        self.assertEqual(Poll.objects.reconcile_counters([first.pk, second.pk]), 0)
+
+
+class SubmissionBatchTests(APITestCase):
+    def test_batch_across_polls(self):
+        first, (color,) = self.create_poll(question('Color'))
+        second, (food,) = self.create_poll(question('Food', 'MC', 'x,y'))
+        items = [{'poll': second.pk, 'answers': [{'question': food.pk, 'answer': 'x,y'}]},
+                 {'poll': first.pk, 'answers': [{'question': color.pk, 'answer': 'b'}]},
+                 {'poll': first.pk, 'answers': [{'question': food.pk, 'answer': 'x'}]},
+                 {'poll': second.pk, 'answers': [{'question': food.pk, 'answer': 'y'}]}]
+        response = self.client.post('/api/v1/submitted-polls/batch/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [201, 201, 400, 201])
+
+        self.assertEqual(Poll.objects.get(pk=first.pk).submission_count, 1)
+        self.assertEqual(Poll.objects.get(pk=second.pk).submission_count, 2)
+        self.assertEqual(sorted(QuestionTally.objects.values_list('question_id', 'option', 'count')),
+                         [(color.pk, 'b', 1), (food.pk, 'x', 1), (food.pk, 'y', 2)])
+        self.assertEqual(Poll.objects.reconcile_counters([first.pk, second.pk]), 0)
+
+
+class PollListQueryTests(APITestCase):
+    urls = ('/api/v1/polls/', '/api/v1/polls/?answer_count=true', '/api/v1/polls/favorites/',
+            '/api/v1/submitted-polls/', '/api/v1/questions/?answer_count=1')
+
+    def add_polls(self, count):
+        for _ in range(count):
+            poll, questions = self.create_poll(question('Color'), question('Age', 'NI', ''))
+            FavoritePoll.objects.add(self.user, poll)
+            self.submit(poll, [(questions[0], 'a'), (questions[1], '1')])
+
+    def query_counts(self):
+        counts = []
+        for url in self.urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+            counts.append(len(queries))
+        return counts
+
+    def test_query_count_does_not_grow_with_polls(self):
+        self.add_polls(2)
+        self.query_counts()
+        few = self.query_counts()
+        self.add_polls(4)
+        self.assertEqual(self.query_counts(), few)
+
+    def test_answer_count_is_opt_in(self):
+        self.add_polls(1)
+        poll = self.client.get('/api/v1/polls/').json()['results'][0]
+        self.assertNotIn('answer_count', poll['questions'][0])
+        poll = self.client.get('/api/v1/polls/?answer_count=true').json()['results'][0]
+        self.assertEqual([q['answer_count'] for q in poll['questions']], [1, 1])
+
+
+class CursorPaginationTests(APITestCase):
+    def ids(self, url):
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            self.assertNotIn('count', page)
+            ids += [item['id'] for item in page['results']]
+            url = page['next']
+        return ids
+
+    def test_pages_with_equal_sort_keys(self):
+        polls = [self.create_poll(question('Color'))[0] for _ in range(7)]
+        Poll._base_manager.update(created_at=timezone.now())
+        expected = sorted((poll.pk for poll in polls), reverse=True)
+        self.assertEqual(self.ids('/api/v1/polls/?page_size=3'), expected)
+        self.assertEqual(self.ids('/api/v1/polls/?page_size=3&ordering=-submission_count'), expected)
+
+    def test_new_items_do_not_shift_pages(self):
+        for _ in range(4):
+            self.create_poll(question('Color'))
+        page = self.client.get('/api/v1/polls/?page_size=2').json()
+        self.create_poll(question('Color'))
+        seen = [poll['id'] for poll in page['results']] + self.ids(page['next'])
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 4)
+
+    def test_submissions_and_answers(self):
+        poll, (color,) = self.create_poll(question('Color'))
+        for _ in range(5):
+            self.submit(poll, [(color, 'a')])
+        self.assertEqual(self.ids('/api/v1/submitted-polls/?page_size=2'),
+                         sorted(SubmittedPoll.objects.values_list('pk', flat=True), reverse=True))
+        self.assertEqual(self.ids('/api/v1/answers/?page_size=2'),
+                         sorted(Answer.objects.values_list('pk', flat=True), reverse=True))
+
+
+class FavoriteFlagTests(APITestCase):
+    def test_is_favorite_is_per_user(self):
+        polls = [self.create_poll(question('Color'))[0] for _ in range(3)]
+        FavoritePoll.objects.add(self.user, polls[1])
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'password')
+        FavoritePoll.objects.add(other, polls[2])
+
+        flags = {poll['id']: poll['isFavorite'] for poll in self.client.get('/api/v1/polls/').json()['results']}
+        self.assertEqual(flags, {polls[0].pk: False, polls[1].pk: True, polls[2].pk: False})
+        self.assertTrue(self.client.get('/api/v1/polls/{}/'.format(polls[1].pk)).json()['isFavorite'])
+        favorites = self.client.get('/api/v1/polls/favorites/').json()['results']
+        self.assertEqual([(poll['id'], poll['isFavorite']) for poll in favorites], [(polls[1].pk, True)])
+
+        anonymous = APIClient(SERVER_NAME='localhost')
+        self.assertFalse(any(poll['isFavorite'] for poll in anonymous.get('/api/v1/polls/').json()['results']))
+
+
+class SubmissionTests(APITestCase):
+    def test_query_count_does_not_grow_with_answers(self):
+        counts = []
+        for size in (2, 20):
+            poll, questions = self.create_poll(*[question('Q{}'.format(i)) for i in range(size)])
+            self.submit(poll, [(questions[0], 'a')])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.submit(poll, [(q, 'a') for q in questions])
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_questions_of_other_polls_are_rejected(self):
+        poll, (color,) = self.create_poll(question('Color'))
+        _, (other,) = self.create_poll(question('Color'))
+        response = self.submit(poll, [(color, 'a'), (other, 'a')])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SubmittedPoll.objects.exists())
+
+    def test_submission_is_saved_with_user_and_answers(self):
+        poll, (color, age) = self.create_poll(question('Color'), question('Age', 'NI', ''))
+        response = self.submit(poll, [(color, 'b'), (age, '3')])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['user'], self.user.email)
+        self.assertEqual(sorted((a['question'], a['answer']) for a in data['answers']), [(color.pk, 'b'), (age.pk, '3')])
+        self.assertEqual(Poll.objects.get(pk=poll.pk).submission_count, 1)
+        self.assertEqual(self.submit(poll, [(age, 'many')]).status_code, 400)
+
+
+class PollUpdateTests(APITestCase):
+    def update(self, poll, questions):
+        return self.client.put('/api/v1/polls/{}/'.format(poll.pk), {'title': 'Edited', 'questions': questions},
+                               format='json')
+
+    def test_questions_are_diffed(self):
+        poll, questions = self.create_poll(question('Color'), question('Food'), question('Age', 'NI', ''))
+        color, food, _ = [self.client.get('/api/v1/questions/{}/'.format(q.pk)).json() for q in questions]
+        color['content'] = 'Colour'
+        response = self.update(poll, [color, food, question('Size', 'MC', 's,m,l')])
+        self.assertEqual(response.status_code, 200, response.content)
+
+        stored = list(poll.questions.order_by('pk').values_list('pk', 'content'))
+        self.assertEqual(stored[:2], [(questions[0].pk, 'Colour'), (questions[1].pk, 'Food')])
+        self.assertEqual(stored[2][1], 'Size')
+        self.assertEqual(Poll.objects.get(pk=poll.pk).question_count, 3)
+        self.assertEqual(list(QuestionOption.objects.filter(question_id=stored[2][0]).values_list('label', flat=True)),
+                         ['s', 'm', 'l'])
+
+    def test_query_count_does_not_grow_with_unchanged_questions(self):
+        counts = []
+        for size in (3, 30):
+            poll, questions = self.create_poll(*[question('Q{}'.format(i)) for i in range(size)])
+            data = [dict(question(q.content), id=q.pk) for q in questions]
+            data[0]['content'] = 'Changed'
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.update(poll, data[:-1] + [question('New')]).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, self.questions = self.create_poll(question('Color'), question('Food', 'MC', 'x,y'))
+        color, food = self.questions
+        for answers in ([(color, 'a'), (food, 'x,y')], [(color, 'b')], [(food, 'y')]):
+            self.submit(self.poll, answers)
+
+    def export(self, output):
+        response = self.client.get('/api/v1/polls/{}/export/?output={}'.format(self.poll.pk, output))
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['submission', 'answered_at', 'user', 'Color', 'Food'])
+        self.assertEqual([row[2:] for row in rows[1:]], [[self.user.email, 'a', 'x,y'], [self.user.email, 'b', ''],
+                                                         [self.user.email, '', 'y']])
+
+    def test_ndjson(self):
+        response, content = self.export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        color, food = (str(q.pk) for q in self.questions)
+        self.assertEqual([line['answers'] for line in lines], [{color: 'a', food: 'x,y'}, {color: 'b'}, {food: 'y'}])
+        self.assertEqual(list(export.iter_submissions(self.poll, chunk_size=1)), list(export.iter_submissions(self.poll)))
+
+    def test_only_owner_exports(self):
+        self.assertEqual(self.client.get('/api/v1/polls/{}/export/?output=xml'.format(self.poll.pk)).status_code, 400)
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/v1/polls/{}/export/'.format(self.poll.pk)).status_code, 401)
+
+
+class PollCacheTests(APITransactionTestCase):
+    def titles(self):
+        return {poll['id']: poll['title'] for poll in self.client.get('/api/v1/polls/').json()['results']}
+
+    def test_cached_polls_follow_writes(self):
+        poll, (color,) = self.create_poll(question('Color'))
+        other, _ = self.create_poll(question('Color'))
+        self.titles()
+        self.assertTrue(get_polls([poll.pk, other.pk]))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.titles(), {poll.pk: 'Poll', other.pk: 'Poll'})
+        self.assertFalse(any('pollsapp_question' in query['sql'] for query in queries.captured_queries))
+
+        response = self.client.put('/api/v1/polls/{}/'.format(poll.pk), {
+            'title': 'Edited', 'questions': [dict(question('Colour'), id=color.pk)]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles(), {poll.pk: 'Edited', other.pk: 'Poll'})
+        self.assertEqual(self.client.get('/api/v1/polls/{}/'.format(poll.pk)).json()['questions'][0]['content'], 'Colour')
+
+        self.assertEqual(self.client.post('/api/v1/polls/{}/archive/'.format(other.pk)).status_code, 200)
+        self.assertEqual(self.titles(), {poll.pk: 'Edited'})
+
+    def test_counters_are_not_cached(self):
+        poll, (color,) = self.create_poll(question('Color'))
+        self.titles()
+        self.submit(poll, [(color, 'a')])
+        FavoritePoll.objects.add(self.user, poll)
+        data = self.client.get('/api/v1/polls/').json()['results'][0]
+        self.assertEqual((data['submission_count'], data['favorite_count'], data['isFavorite']), (1, 1, True))
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, self.questions = self.create_poll(question('Color'))
+        self.url = '/api/v1/polls/{}/'.format(self.poll.pk)
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(queries), 2)
+
+    def test_poll_and_results_return_304_until_changed(self):
+        for url in (self.url, self.url + 'results/'):
+            response = self.client.get(url)
+            self.assertIn('Last-Modified', response)
+            self.assertNotModified(url, response['ETag'])
+
+        etag = self.client.get(self.url + 'results/')['ETag']
+        self.submit(self.poll, [(self.questions[0], 'a')])
+        response = self.client.get(self.url + 'results/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_user(self):
+        etag = self.client.get(self.url)['ETag']
+        FavoritePoll.objects.add(self.user, self.poll)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['isFavorite'])
+
+        anonymous = APIClient(SERVER_NAME='localhost')
+        self.assertNotEqual(anonymous.get(self.url)['ETag'], response['ETag'])
+
+
+@override_settings(MIDDLEWARE=['pollsapp.middleware.QueryInstrumentationMiddleware'] + settings.MIDDLEWARE,
+                   POLLS_QUERY_BUDGET=3)
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_server_timing_and_budget(self):
+        poll, _ = self.create_poll(question('Color'), question('Food'))
+        response = self.client.get('/api/v1/polls/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, '
+                                                    r'total;dur=[\d.]+$')
+        response = self.client.put('/api/v1/polls/{}/'.format(poll.pk), {'title': 'Edited', 'questions': []},
+                                   format='json')
+        self.assertIn('X-Query-Budget-Exceeded', response)
+
+    def test_metrics_are_aggregated_per_endpoint(self):
+        self.client.get('/api/v1/polls/')
+        self.client.get('/api/v1/polls/')
+        self.assertEqual(self.client.get('/api/v1/metrics/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        endpoints = self.client.get('/api/v1/metrics/').json()['endpoints']
+        self.assertEqual(endpoints['PollViewSet.list']['requests'], 2)
+        self.assertEqual(sum(endpoints['PollViewSet.list']['latency_histogram']), 2)
+
+        self.assertEqual(self.client.delete('/api/v1/metrics/').status_code, 204)
+        self.assertNotIn('PollViewSet.list', self.client.get('/api/v1/metrics/').json()['endpoints'])
+
+
+class LoadTestCommandTests(TestCase):
+    def test_seed_and_benchmark(self):
+        call_command('seed_polls', users=3, polls=4, questions=3, submissions=20, favorites=2, seed=1,
+                     stdout=io.StringIO())
+        self.assertEqual(Poll._base_manager.count(), 4)
+        self.assertEqual(SubmittedPoll.objects.count(), 20)
+        polls = list(Poll._base_manager.values_list('pk', flat=True))
+        self.assertEqual(Poll.objects.reconcile_counters(polls), 0)
+        self.assertEqual(sum(QuestionTally.objects.values_list('count', flat=True)),
+                         sum(len(value.split(',')) for value in Answer.objects.filter(selection__isnull=False)
+                             .values_list('answer', flat=True)))
+
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as output:
+            call_command('benchmark_api', iterations=2, warmup=0, output=output.name, stdout=io.StringIO())
+            results = json.load(output)
+        self.assertEqual(set(results['scenarios']),
+                         {'list', 'retrieve', 'favorites', 'archived', 'results', 'submit', 'update'})
+        self.assertTrue(all(status < 400 for result in results['scenarios'].values() for status in result['statuses']),
+                        results['scenarios'])
+
+
+class UniqueFavoriteTests(APITestCase):
+    def test_repeated_favorite_is_stored_once(self):
+        poll, _ = self.create_poll(question('Color'))
+        for _ in range(2):
+            self.client.post('/api/v1/favorite-polls/', {'poll': poll.pk})
+        self.assertFalse(FavoritePoll.objects.add(self.user, poll))
+        self.assertEqual(FavoritePoll.objects.count(), 1)
+        self.assertEqual(Poll.objects.get(pk=poll.pk).favorite_count, 1)
+        self.assertEqual(len(self.client.get('/api/v1/polls/favorites/').json()['results']), 1)
+
+        output = io.StringIO()
+        call_command('dedupe_favorites', stdout=output)
+        self.assertIn('Removed 0 duplicate favorites', output.getvalue())
+
+
+class LiveResultsTests(APITransactionTestCase):
+    def stream(self, poll_id, on_open=None, events=0):
+        sent = []
+
+        async def run():
+            inbox = asyncio.Queue()
+
+            async def receive():
+                return await inbox.get()
+
+            async def send(message):
+                sent.append(message)
+                if sum(b'event: tally' in item.get('body', b'') for item in sent) == events:
+                    await inbox.put({'type': 'http.disconnect'})
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/api/v1/polls/{}/live/'.format(poll_id),
+                     'query_string': b'', 'headers': [(b'origin', b'https://example.com')]}
+            stream = asyncio.ensure_future(application(scope, receive, send))
+            await asyncio.sleep(0.2)
+            if on_open is not None:
+                await asyncio.get_event_loop().run_in_executor(None, on_open)
+            await asyncio.wait_for(stream, 5)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        return sent
+
+    def test_snapshot_then_tallies(self):
+        poll, (color, age) = self.create_poll(question('Color'), question('Age', 'NI', ''))
+        self.submit(poll, [(color, 'a')])
+
+        def submit():
+            self.submit(poll, [(color, 'b'), (age, '7')])
+            self.submit(poll, [(color, 'b')])
+
+        sent = self.stream(poll.pk, submit, events=2)
+        self.assertEqual(sent[0]['status'], 200)
+        headers = dict(sent[0]['headers'])
+        self.assertEqual(headers[b'content-type'], b'text/event-stream')
+        self.assertEqual(headers[b'access-control-allow-origin'], b'*')
+
+        events = [body for body in (message.get('body', b'') for message in sent[1:]) if body.startswith(b'event:')]
+        name, data = events[0].decode().split('\n')[:2]
+        results = json.loads(data[len('data: '):])
+        self.assertEqual((name, results['questions'][0]['results']), ('event: results', {'a': 1, 'b': 0}))
+
+        tallies = [json.loads(event.decode().split('\n')[1][len('data: '):]) for event in events[1:]]
+        self.assertEqual([tally['questions'][str(color.pk)]['options'] for tally in tallies], [{'b': 1}, {'b': 1}])
+        self.assertEqual(tallies[0]['questions'][str(age.pk)]['values'], [7])
+
+    def test_missing_poll(self):
+        self.assertEqual(self.stream(0)[0]['status'], 404)
+
+
+class NumericResultsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, (self.age,) = self.create_poll(question('Age', 'NI', ''))
+        rng = random.Random(3)
+        self.values = [round(rng.lognormvariate(3, 1), 2) for _ in range(200)] + [0, -5.5]
+        for value in self.values:
+            self.submit(self.poll, [(self.age, str(value))])
+
+    def results(self):
+        return self.client.get('/api/v1/polls/{}/results/'.format(self.poll.pk)).json()['questions'][0]['results']
+
+    def test_statistics_and_quantiles(self):
+        results = self.results()
+        self.assertEqual((results['count'], results['min'], results['max']), (202, -5.5, max(self.values)))
+        self.assertAlmostEqual(results['mean'], statistics.mean(self.values))
+        self.assertAlmostEqual(results['variance'], statistics.pvariance(self.values), places=6)
+        ordered = sorted(self.values)
+        for name, q in (('p50', 0.5), ('p90', 0.9)):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(results['quantiles'][name] - exact), exact * 0.01 + 1e-9)
+        self.assertEqual(sum(bucket['count'] for bucket in results['histogram']), 202)
+
+        QuestionTally.objects.rebuild()
+        rebuilt = self.results()
+        self.assertEqual(rebuilt['quantiles'], results['quantiles'])
+        self.assertAlmostEqual(rebuilt['variance'], results['variance'])
+
+    def test_merged_summaries_match(self):
+        first, second, whole = NumericSummary(), NumericSummary(), NumericSummary()
+        for value in self.values[:50]:
+            first.add(value)
+        for value in self.values[50:]:
+            second.add(value)
+        for value in self.values:
+            whole.add(value)
+        first.merge(second)
+        self.assertAlmostEqual(first.variance, whole.variance)
+        self.assertEqual(first.quantiles(), whole.quantiles())
+
+    def test_values_that_are_not_finite_numbers_are_rejected(self):
+        for value in ('inf', 'nan', '1e999', 'abc'):
+            self.assertEqual(self.submit(self.poll, [(self.age, value)]).status_code, 400, value)
+        self.assertEqual(self.results()['count'], 202)
+
+
+class RendererTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, (self.color,) = self.create_poll(question('Boja'))
+        Poll._base_manager.filter(pk=self.poll.pk).update(title='Čćž anketa')
+        self.body = {'poll': self.poll.pk, 'answers': [{'question': self.color.pk, 'answer': 'a'}]}
+
+    def test_json(self):
+        response = self.client.get('/api/v1/polls/{}/'.format(self.poll.pk))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content)['title'], 'Čćž anketa')
+        self.assertEqual(self.client.post('/api/v1/submitted-polls/', json.dumps(self.body),
+                                          content_type='application/json').status_code, 201)
+        self.assertEqual(self.client.post('/api/v1/submitted-polls/', b'{bad',
+                                          content_type='application/json').status_code, 400)
+
+    @skipUnless(find_spec('msgpack'), 'msgpack is not installed')
+    def test_msgpack(self):
+        import msgpack
+
+        response = self.client.get('/api/v1/polls/{}/'.format(self.poll.pk), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['title'], 'Čćž anketa')
+        response = self.client.post('/api/v1/submitted-polls/', msgpack.packb(self.body),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)['answers'][0]['answer'], 'a')
+        self.assertEqual(self.client.post('/api/v1/submitted-polls/', b'\xc1',
+                                          content_type='application/msgpack').status_code, 400)
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(CACHES=dict(settings.CACHES, pins={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.directory}))
+        self.settings.enable()
+        self.pin_cache = mock.patch('pollsapp.routers.PIN_CACHE', 'pins')
+        self.pin_cache.start()
+        self.user = CustomUser.objects.create_user('user', 'user@example.com', 'password')
+        self.other = CustomUser.objects.create_user('other', 'other@example.com', 'password')
+
+        self.middleware = routers.ReplicaMiddleware(
+            lambda request: HttpResponse(routers.ReplicaRouter().db_for_read(Poll)))
+        self.middleware.replicas = ['replica1']
+
+    def tearDown(self):
+        self.pin_cache.stop()
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def request(self, method, user, cookies=None):
+        request = getattr(RequestFactory(), method)('/api/v1/polls/')
+        request.user = user
+        request.COOKIES.update(cookies or {})
+        return self.middleware(request)
+
+    def test_process_local_pin_cache_is_rejected(self):
+        with mock.patch('pollsapp.routers.PIN_CACHE', 'default'):
+            with self.assertRaises(ImproperlyConfigured):
+                routers.ReplicaMiddleware(lambda request: HttpResponse())
+
+    def test_writers_read_their_writes(self):
+        self.assertEqual(self.request('get', self.user).content, b'replica1')
+        response = self.request('post', self.user)
+        self.assertEqual(response.content, b'default')
+        self.assertIn(routers.PRIMARY_COOKIE, response.cookies)
+
+        self.assertEqual(self.request('get', self.user).content, b'default')
+        self.assertEqual(self.request('get', self.other).content, b'replica1')
+        self.assertEqual(self.request('get', AnonymousUser(), {routers.PRIMARY_COOKIE: '1'}).content, b'default')
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Poll), 'default')
+
+
+class PollCounterTests(APITestCase):
+    def counters(self, poll):
+        return Poll._base_manager.filter(pk=poll.pk).values_list('favorite_count', 'submission_count', 'question_count')[0]
+
+    def test_counters_follow_writes(self):
+        poll, (color, food) = self.create_poll(question('Color'), question('Food'))
+        self.assertEqual(self.counters(poll), (0, 0, 2))
+        for _ in range(2):
+            self.submit(poll, [(color, 'a')])
+        self.client.post('/api/v1/favorite-polls/', {'poll': poll.pk})
+        self.assertEqual(self.counters(poll), (1, 2, 2))
+
+        self.assertEqual(self.client.delete('/api/v1/questions/{}/'.format(food.pk)).status_code, 204)
+        self.assertEqual(self.client.delete('/api/v1/favorite-polls/{}/'.format(poll.pk)).status_code, 204)
+        submission = SubmittedPoll.objects.first()
+        self.assertEqual(self.client.delete('/api/v1/submitted-polls/{}/'.format(submission.pk)).status_code, 204)
+        self.assertEqual(self.counters(poll), (0, 1, 1))
+
+    def test_ordering_and_filtering(self):
+        quiet, (color,) = self.create_poll(question('Color'))
+        busy, (other,) = self.create_poll(question('Color'))
+        for _ in range(3):
+            self.submit(busy, [(other, 'a')])
+        self.submit(quiet, [(color, 'a')])
+
+        ids = [poll['id'] for poll in self.client.get('/api/v1/polls/?ordering=-submission_count').json()['results']]
+        self.assertEqual(ids, [busy.pk, quiet.pk])
+        ids = [poll['id'] for poll in self.client.get('/api/v1/polls/?submission_count__gte=2').json()['results']]
+        self.assertEqual(ids, [busy.pk])
+
+    def test_reconcile_fixes_drift(self):
+        poll, (color,) = self.create_poll(question('Color'))
+        self.submit(poll, [(color, 'a')])
+        FavoritePoll.objects.add(self.user, poll)
+        Poll._base_manager.update(favorite_count=7, submission_count=0, question_count=9)
+        call_command('reconcile_poll_counters', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.counters(poll), (1, 1, 1))
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll, (self.color,) = self.create_poll(question('Color'))
+        self.submit(self.poll, [(self.color, 'a')])
+
+    def first(self, url):
+        data = self.client.get(url).json()
+        return data['results'][0] if 'results' in data else data
+
+    def test_poll_fields_and_expansions(self):
+        self.assertEqual(self.first('/api/v1/polls/?fields=id,title,user'),
+                         {'id': self.poll.pk, 'title': 'Poll', 'user': self.user.email})
+        self.assertEqual(self.first('/api/v1/polls/?fields=id,user&expand=user'),
+                         {'id': self.poll.pk, 'user': {'id': self.user.pk, 'username': 'user', 'email': self.user.email}})
+        self.assertEqual(self.first('/api/v1/polls/?fields=title,questions.content&expand=questions.options'),
+                         {'title': 'Poll', 'questions': [{'content': 'Color', 'options': [
+                             {'position': 0, 'label': 'a'}, {'position': 1, 'label': 'b'}]}]})
+        self.assertEqual(self.first('/api/v1/polls/{}/?fields=id,title'.format(self.poll.pk)),
+                         {'id': self.poll.pk, 'title': 'Poll'})
+        self.assertIn('questions', self.first('/api/v1/polls/'))
+
+    def test_submission_fields_and_expansions(self):
+        self.assertEqual(set(self.first('/api/v1/submitted-polls/?fields=id,poll')), {'id', 'poll'})
+        submission = self.first('/api/v1/submitted-polls/?fields=id,answers.answer&expand=poll')
+        self.assertEqual(submission['poll'], {'id': self.poll.pk, 'title': 'Poll', 'description': ''})
+        self.assertEqual(submission['answers'], [{'answer': 'a'}])
+
+    def test_unrequested_relations_are_not_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/v1/polls/?fields=id,title')
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('pollsapp_question', sql)
+        self.assertNotIn('"pollsapp_poll"."description"', sql)
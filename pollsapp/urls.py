@@ -12,6 +12,7 @@ router.register(r'favorite-polls', views.FavoritePollViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('users/', views.UserListView.as_view()),
+    path('metrics/', views.RequestMetricsView.as_view()),
     path('auth/', include('rest_auth.urls')),
     path('auth/registration/', include('rest_auth.registration.urls')),
 ]
\ No newline at end of file
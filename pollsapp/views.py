@@ -3,22 +3,53 @@ from rest_framework import generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, BasePermission
-
-from .serializers import PollSerializer, QuestionSerializer, SubmittedPollSerializer, AnswerSerializer, UserSerializer, FavoritePollSerializer
-from .models import Poll, Question, SubmittedPoll, Answer, CustomUser, FavoritePoll
-from django.http import HttpResponseForbidden
+from rest_framework.views import APIView
+
+from .serializers import BATCH_LIMIT, validate_submission_batch, FavoritePollBatchSerializer, wants_answer_count, fieldset_params, top_level, nested_paths, UserSummarySerializer, PollSummarySerializer, PollSerializer, QuestionSerializer, SubmittedPollSerializer, AnswerSerializer, UserSerializer, FavoritePollSerializer, PollResultsSerializer
+from .models import Poll, Question, QuestionOption, SubmittedPoll, Answer, CustomUser, FavoritePoll
+from django.db import transaction
+from django.db.models import BooleanField, Count, Exists, OuterRef, Prefetch, Value, prefetch_related_objects
+from django.http import HttpResponseForbidden, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from calendar import timegm
 from django.shortcuts import get_object_or_404
 from pollsapp.models import PollManager
+from .analytics import AnalyticsError, analyze
+from .buffer import BufferFull, get_buffer
+from .cache import get_polls, set_polls, invalidate_poll
+from .export import EXPORT_FORMATS
+from .filters import PollSearchFilter
+from .middleware import metrics
+from .pagination import PollCursorPagination, SubmittedPollCursorPagination, AnswerCursorPagination
 
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from rest_framework import filters
 
 
 class UserListView(generics.ListAPIView):
-    queryset = CustomUser.objects.all()
+    queryset = CustomUser.objects.prefetch_related('polls')
     serializer_class = UserSerializer
 
 
+class RequestMetricsView(APIView):
+    """
+    Per-endpoint query and latency aggregates collected by QueryInstrumentationMiddleware in this process.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        snapshot = metrics.snapshot()
+        buffer = get_buffer()
+        if buffer is not None:
+            snapshot['submission_buffer'] = buffer.stats()
+        return Response(snapshot)
+
+    def delete(self, request):
+        metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class IsPollAdministrator(BasePermission):
     """
     Allows access only to authenticated users.
@@ -29,13 +60,35 @@ class IsPollAdministrator(BasePermission):
             request.user.is_authenticated and 
             request.user.has_perm('pollsapp.archived_polls_administration'))
 
+UNCACHED_POLL_FIELDS = ('isFavorite', 'favorite_count', 'submission_count', 'question_count')
+
+
+def model_columns(model, names):
+    # polja serializera koja su stupci modela (FK polje ucitava samo <name>_id)
+    concrete = {field.name for field in model._meta.concrete_fields}
+    return [name for name in names if name in concrete]
+
+
+def related_columns(relation, fields):
+    return ['{}__{}'.format(relation, field) for field in fields]
+
+
 class PollViewSet(viewsets.ModelViewSet):
     queryset = Poll.objects.all()
     
     serializer_class = PollSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    pagination_class = PollCursorPagination
+    filter_backends = [DjangoFilterBackend, PollSearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description']    
-    filterset_fields = ('user',)
+    filterset_fields = {
+        'user': ['exact'],
+        'favorite_count': ['gte', 'lte'],
+        'submission_count': ['gte', 'lte'],
+        'question_count': ['gte', 'lte'],
+    }
+    # ?ordering=-submission_count ("najvise odgovora") bez agregacije, po brojacima na anketi
+    ordering_fields = ['created_at', 'favorite_count', 'submission_count', 'question_count']
+    ordering = ('-created_at', '-id')
     permission_classes_by_action = {'create': [IsAuthenticated]}    
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
@@ -46,26 +99,61 @@ class PollViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[IsPollAdministrator])
     def restore(self, request, pk=None):
         Poll.objects.restore(self.kwargs['pk'])
-        return Response({'status': 'poll {id} successfully restored'.format(self.kwargs['pk'])})        
+        return Response({'status': 'poll {} successfully restored'.format(self.kwargs['pk'])})        
 
     @action(detail=False, methods=['get'], permission_classes=[IsPollAdministrator])
     def archived(self, request):
-        polls = list(self.filter_queryset(Poll.objects.get_archived()))
-        if (request.user.is_authenticated):
-            self.setIsFavorite(polls)
-
-        serializer = self.get_serializer(polls, many=True)
-        return Response(serializer.data)      
+        queryset = self.filter_queryset(self.sparse_queryset(self.annotateIsFavorite(Poll.objects.get_archived())))
+        return self.paginated_response(queryset)
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def favorites(self, request):
         user = self.request.user
-        favoritePolls = self.filter_queryset(Poll.objects.get_favorites(user))
-        for poll in favoritePolls:
-            poll.isFavorite = True
-        
-        serializer = PollSerializer(favoritePolls, many=True)     
-        return Response(serializer.data)   
+        favoritePolls = Poll.objects.get_favorites(user).annotate(is_favorite=Value(True, output_field=BooleanField()))
+        return self.paginated_response(self.filter_queryset(self.sparse_queryset(favoritePolls)))
+
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        validators = self.poll_validators(Poll.objects.all(), 'results')
+        response = get_conditional_response(request, **validators)
+        if response is None:
+            queryset = Poll.objects.prefetch_related('questions', 'questions__tallies', 'questions__numeric_summary')
+            poll = get_object_or_404(queryset, pk=self.kwargs['pk'])
+            serializer = PollResultsSerializer(poll)
+            response = Response(serializer.data)
+        return self.set_validators(response, **validators)
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        # ?question=<id>[&by=<id>][&where=<id>:<position>,<position>][&where=<id>:<min>..<max>]
+        poll = get_object_or_404(Poll.objects.all(), pk=self.kwargs['pk'])
+        try:
+            question_id = int(request.query_params['question'])
+            by_id = int(request.query_params['by']) if 'by' in request.query_params else None
+        except (KeyError, ValueError):
+            return Response({'question': 'question (and by) must be question ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            data = analyze(poll, question_id, by_id, request.query_params.getlist('where'))
+        except AnalyticsError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request, pk=None):
+        poll = get_object_or_404(Poll.objects.all(), pk=self.kwargs['pk'])
+        if not (poll.user_id == request.user.id or IsPollAdministrator().has_permission(request, self)):
+            return Response({'status': 'unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        # ?output=csv|ndjson (?format je rezerviran za DRF renderere)
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({'output': 'Unsupported export format.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows, content_type = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(rows(poll), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="poll-{}.{}"'.format(poll.id, output)
+        return response
 
     @action(detail=True, methods=['delete'], permission_classes=[IsPollAdministrator])
     def delete(self, request, *args, **kwargs):
@@ -76,33 +164,16 @@ class PollViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)           
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        if (request.user.is_authenticated):
-            self.setIsFavorite(instance, many=False)        
-
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)        
+        validators = self.poll_validators(self.get_queryset())
+        response = get_conditional_response(request, **validators)
+        if response is None:
+            instance = self.get_object()
+            response = Response(self.serialize_polls([instance])[0])
+        return self.set_validators(response, **validators)
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        polls = list(queryset)
-
-        # TODO: Introduce pagination at some later point
-        # page = self.paginate_queryset(queryset)
-        # if page is not None:
-        #     polls = list(page)
-        #     serializer = self.get_serializer(polls, many=True)
-        #     if (request.user.is_authenticated):
-        #         self.setIsFavorite(serializer)
-
-        #     return self.get_paginated_response(serializer.data)
-
-        
-        if (request.user.is_authenticated):
-            self.setIsFavorite(polls)
-
-        serializer = self.get_serializer(polls, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(queryset)
     
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -122,16 +193,96 @@ class PollViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         Poll.objects.update(serializer.instance, serializer.validated_data)
 
-    def setIsFavorite(self, data, many=True):
-        favorites = list(FavoritePoll.objects.filter(user_id = self.request.user.id))
+    def perform_destroy(self, instance):
+        # brisanje u serijama umjesto kaskade koja ucitava sve submissione i odgovore ankete
+        Poll.objects.purge([instance.pk])
 
-        if (many):
-            for poll in data:
-                favorite = next((fav for fav in favorites if fav.poll_id == poll.id), None)
-                poll.isFavorite = favorite is not None
-        else:
-            favorite = next((fav for fav in favorites if fav.poll_id == data.id), None)
-            data.isFavorite = favorite is not None
+    def get_queryset(self):
+        return self.sparse_queryset(self.annotateIsFavorite(super().get_queryset()))
+
+    def sparse_queryset(self, queryset):
+        # ?fields= ucitava samo stupce trazenih polja i stupce po kojima se redaju stranice
+        fields, expand = fieldset_params(self.request)
+        if fields is None:
+            return queryset.select_related('user')
+
+        wanted = top_level(fields)
+        columns = ['id'] + self.ordering_fields + model_columns(Poll, wanted - {'user'})
+        if 'user' in wanted:
+            queryset = queryset.select_related('user')
+            columns += related_columns('user', UserSummarySerializer.Meta.fields if 'user' in expand else ('email',))
+        return queryset.only(*columns)
+
+    def paginated_response(self, queryset):
+        # keyset (cursor) paginacija - dohvat dubokih stranica je jednako skup kao i prve
+        polls = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.serialize_polls(polls))
+
+    def poll_validators(self, queryset, tag=''):
+        # ETag i Last-Modified se racunaju iz verzije ankete bez ucitavanja pitanja i serijalizacije
+        fields = ['version', 'modified_at', 'favorite_count']
+        if self.request.user.is_authenticated and 'is_favorite' in queryset.query.annotations:
+            fields.append('is_favorite')
+        row = get_object_or_404(queryset.values(*fields), pk=self.kwargs['pk'])
+
+        # favoriti ne mijenjaju verziju ankete pa je njihov broj dio ETaga
+        parts = [self.kwargs['pk'], row['version'], row['favorite_count'], tag]
+        if row.get('is_favorite'):
+            parts.append('favorite')
+        return {
+            'etag': quote_etag('-'.join(str(part) for part in parts if part != '')),
+            'last_modified': timegm(row['modified_at'].utctimetuple()),
+        }
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def serialize_polls(self, polls):
+        # cachira se dio ankete koji se ne mijenja sa svakim favoritom/submissionom;
+        # isFavorite i brojaci se dodaju iz ucitanih anketa nakon dohvata iz cachea
+        fields, expand = fieldset_params(self.request)
+        if wants_answer_count(self.request) or fields is not None or expand:
+            self.prefetch_related_data(polls)
+            return self.get_serializer(polls, many=True).data
+
+        cached = get_polls([poll.id for poll in polls])
+        missing = [poll for poll in polls if poll.id not in cached]
+        if missing:
+            self.prefetch_related_data(missing)
+            serialized = {}
+            for data in self.get_serializer(missing, many=True).data:
+                for field in UNCACHED_POLL_FIELDS:
+                    data.pop(field)
+                serialized[data['id']] = data
+            set_polls(serialized)
+            cached.update(serialized)
+
+        return [dict(cached[poll.id], **{field: getattr(poll, field) for field in UNCACHED_POLL_FIELDS}) for poll in polls]
+
+    def prefetch_related_data(self, polls):
+        fields, expand = fieldset_params(self.request)
+        if fields is not None and 'questions' not in top_level(fields):
+            return
+
+        questions = Question.objects.all()
+        question_fields = nested_paths(fields, 'questions')
+        if question_fields is not None:
+            questions = questions.only('id', 'poll', *model_columns(Question, top_level(question_fields)))
+        if wants_answer_count(self.request):
+            questions = questions.annotate(answer_count=Count('answers'))
+        if 'questions.options' in expand:
+            questions = questions.prefetch_related('options')
+        prefetch_related_objects(polls, Prefetch('questions', queryset=questions))
+
+    def annotateIsFavorite(self, queryset):
+        # oznaka favorita racuna se u bazi (EXISTS po anketi) umjesto prolaska kroz sve favorite korisnika
+        if not self.request.user.is_authenticated:
+            return queryset
+        favorites = FavoritePoll.objects.filter(user_id=self.request.user.id, poll_id=OuterRef('pk'))
+        return queryset.annotate(is_favorite=Exists(favorites))
 
     def get_permissions(self):
         try:
@@ -146,8 +297,31 @@ class QuestionViewSet(viewsets.ModelViewSet):
     queryset = Question.objects.all()
     serializer_class = QuestionSerializer
 
+    def perform_update(self, serializer):
+        # nova verzija ankete - ETag ankete i cache analitike ne smiju ostati na starim pitanjima
+        with transaction.atomic():
+            question = serializer.save()
+            if {'choices', 'type'} & serializer.validated_data.keys():
+                QuestionOption.objects.sync([question])
+            Poll.objects.touch(question.poll_id)
+        transaction.on_commit(lambda: invalidate_poll(question.poll_id))
+
+    def perform_destroy(self, instance):
+        poll_id = instance.poll_id
+        with transaction.atomic():
+            instance.delete()
+            Poll.objects.touch(poll_id, question_count=-1)
+        transaction.on_commit(lambda: invalidate_poll(poll_id))
+
     def get_queryset(self):
         queryset = Question.objects.all()
+        fields, expand = fieldset_params(self.request)
+        if fields is not None:
+            queryset = queryset.only('id', *model_columns(Question, top_level(fields)))
+        if 'options' in expand:
+            queryset = queryset.prefetch_related('options')
+        if wants_answer_count(self.request):
+            queryset = queryset.annotate(answer_count=Count('answers'))
         poll = self.request.query_params.get('poll', None)
         if poll is not None:
             queryset = queryset.filter(poll=poll)
@@ -155,10 +329,84 @@ class QuestionViewSet(viewsets.ModelViewSet):
 
 
 class SubmittedPollViewSet(viewsets.ModelViewSet):
-    queryset = SubmittedPoll.objects.all()
+    queryset = SubmittedPoll.objects.select_related('user').prefetch_related('answers')
     serializer_class = SubmittedPollSerializer
+    pagination_class = SubmittedPollCursorPagination
     filterset_fields = ('poll',)
 
+    def get_queryset(self):
+        # ?fields= / ?expand= - ucitavaju se samo trazeni stupci, a relacije samo kad su trazene
+        fields, expand = fieldset_params(self.request)
+        if fields is None and not expand:
+            return super().get_queryset()
+
+        wanted = top_level(fields) if fields is not None else set(self.get_serializer_class().Meta.fields)
+        queryset = SubmittedPoll.objects.all()
+        columns = ['id', 'answered_at'] + model_columns(SubmittedPoll, wanted)
+        if 'user' in wanted:
+            queryset = queryset.select_related('user')
+            columns += related_columns('user', UserSummarySerializer.Meta.fields if 'user' in expand else ('email',))
+        if 'poll' in wanted and 'poll' in expand:
+            queryset = queryset.select_related('poll')
+            columns += related_columns('poll', PollSummarySerializer.Meta.fields)
+        if 'answers' in wanted:
+            answers = Answer.objects.all()
+            answer_fields = nested_paths(fields, 'answers')
+            if answer_fields is not None:
+                answers = answers.only('id', 'submitted_poll', *model_columns(Answer, top_level(answer_fields)))
+            queryset = queryset.prefetch_related(Prefetch('answers', queryset=answers))
+        return queryset.only(*columns)
+
+    def create(self, request, *args, **kwargs):
+        buffer = get_buffer()
+        if buffer is None:
+            return super().create(request, *args, **kwargs)
+
+        # write-behind: validirani submission se sprema u lokalni buffer, a u bazu ga upisuje flusher
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        answers = [{'question_id': answer['question_id'], 'answer': answer.get('answer')}
+                   for answer in serializer.validated_data['answers']]
+        try:
+            buffer.enqueue(serializer.validated_data['poll'].id, request.user.id, answers)
+        except BufferFull:
+            return Response({'status': 'busy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(max(1, round(buffer.interval)))})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        # npr. kiosk koji je prikupljao odgovore offline - ispravne stavke se spremaju, za ostale se vracaju greske
+        items = request.data
+        if not isinstance(items, list) or not 0 < len(items) <= BATCH_LIMIT:
+            return Response({'detail': 'Expected a list of 1 to {} submissions.'.format(BATCH_LIMIT)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        valid, errors, questions = validate_submission_batch(items)
+        results = [None] * len(items)
+        for index, error in errors.items():
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': error}
+
+        user = request.user if request.user.id else None
+        buffer = get_buffer()
+        if buffer is None:
+            submitted = SubmittedPoll.objects.bulk_submit(
+                [(SubmittedPoll(poll_id=data['poll'], user=user), data['answers']) for _, data in valid], questions)
+            for (index, _), submitted_poll in zip(valid, submitted):
+                results[index] = {'index': index, 'status': status.HTTP_201_CREATED, 'id': submitted_poll.id}
+        else:
+            for index, data in valid:
+                answers = [{'question_id': answer['question_id'], 'answer': answer.get('answer')} for answer in data['answers']]
+                try:
+                    buffer.enqueue(data['poll'], user and user.id, answers)
+                    results[index] = {'index': index, 'status': status.HTTP_202_ACCEPTED}
+                except BufferFull:
+                    results[index] = {'index': index, 'status': status.HTTP_503_SERVICE_UNAVAILABLE}
+
+        failed = sum(result['status'] >= 400 for result in results)
+        return Response({'results': results, 'failed': failed},
+                        status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK)
+
     def perform_create(self, serializer):
         user = self.request.user
         if user.id:
@@ -166,27 +414,36 @@ class SubmittedPollViewSet(viewsets.ModelViewSet):
         else:
             serializer.save()
 
+    def perform_destroy(self, instance):
+        SubmittedPoll.objects.remove(instance)
+
 
 class AnswerViewSet(viewsets.ModelViewSet):
     queryset = Answer.objects.all()
     serializer_class = AnswerSerializer
+    pagination_class = AnswerCursorPagination
+
+    def perform_update(self, serializer):
+        # strukturirani oblik i zbrojevi prate izmijenjeni tekst odgovora
+        answer = serializer.validated_data.get('answer', serializer.instance.answer)
+        serializer.instance = Answer.objects.change(serializer.instance, answer)
+
+    def perform_destroy(self, instance):
+        Answer.objects.remove(instance)
 
 class FavoritePollViewSet(viewsets.ModelViewSet):
     queryset = FavoritePoll.objects.all()
     serializer_class = FavoritePollSerializer
     permission_classes = (IsAdminUser,) 
     permission_classes_by_action = {'create': [IsAuthenticated],
-                                    'destroy' : [IsAuthenticated]}
+                                    'destroy' : [IsAuthenticated],
+                                    'batch': [IsAuthenticated]}
 
 
     def perform_create(self, serializer):
         user=self.request.user
         poll = Poll.objects.get(pk=self.request.data['poll'])
-        if not (FavoritePoll.objects.filter(user_id=user.id,poll_id=poll.id).exists()):
-            favoritePoll = FavoritePoll()
-            favoritePoll.user = user
-            favoritePoll.poll = poll
-            favoritePoll.save()
+        FavoritePoll.objects.add(user, poll)
 
     def destroy(self, request, *args, **kwargs):
         user=self.request.user
@@ -194,6 +451,25 @@ class FavoritePollViewSet(viewsets.ModelViewSet):
         
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)            
+
+    def perform_destroy(self, instance):
+        FavoritePoll.objects.remove(instance)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        # {"add": [poll id, ...], "remove": [poll id, ...]} - rezultat se vraca za svaku anketu
+        serializer = FavoritePollBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add, remove = serializer.validated_data['add'], serializer.validated_data['remove']
+
+        polls = set(Poll.objects.filter(pk__in=add).values_list('pk', flat=True))
+        added = FavoritePoll.objects.add_many(request.user, [pk for pk in add if pk in polls])
+        removed = FavoritePoll.objects.remove_many(request.user, remove)
+
+        results = [{'poll': pk, 'action': 'add',
+                    'status': 'added' if pk in added else 'unchanged' if pk in polls else 'not_found'} for pk in add]
+        results += [{'poll': pk, 'action': 'remove', 'status': 'removed' if pk in removed else 'unchanged'} for pk in remove]
+        return Response({'results': results})
        
 
     def get_permissions(self):